@@ -0,0 +1,290 @@
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import zipfile
+from patchbox import settings
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ExtractedArchive(object):
+    """What extract_archive wrote, and the content hash of it"""
+
+    def __init__(self):
+        self.entries = {}
+        self.files = 0
+        self.linked = 0
+        self.written_bytes = 0
+        self.linked_bytes = 0
+
+    def add(self, name, kind, value=''):
+        self.entries[name.rstrip('/')] = '{}:{}'.format(kind, value)
+
+    @property
+    def hash(self):
+        """Hash of the extracted names, types, exec bits and contents, independent of archive format and order"""
+        hasher = hashlib.sha256()
+        for name in sorted(self.entries):
+            hasher.update('{}\0{}\n'.format(name, self.entries[name]).encode('utf-8'))
+        return 'tree:' + hasher.hexdigest()
+
+
+def _check_path(dest, name, target=None):
+    """Raises ArchiveError if name (or the target it resolves to) lands outside of dest"""
+    target = target if target is not None else name
+    if os.path.isabs(name) or os.path.isabs(target):
+        raise ArchiveError('absolute path in archive: {}'.format(name))
+    # realpath follows links extracted earlier, so they can't be used to escape either.
+    resolved = os.path.realpath(os.path.join(dest, target))
+    if os.path.commonpath([dest, resolved]) != dest:
+        raise ArchiveError('path escapes the extraction folder: {}'.format(name))
+
+
+def _checked_tar_members(tar, dest):
+    for member in tar:
+        _check_path(dest, member.name)
+        if member.issym():
+            _check_path(dest, member.name, os.path.join(os.path.dirname(member.name), member.linkname))
+        elif member.islnk():
+            _check_path(dest, member.name, member.linkname)
+        elif not (member.isfile() or member.isdir()):
+            raise ArchiveError('unsupported member type in archive: {}'.format(member.name))
+        member.mode &= 0o777
+        yield member
+
+
+def _tar_owner(member):
+    """The uid and gid TarFile.chown gives member, None if it leaves the owner alone"""
+    if os.geteuid() != 0:
+        return None
+    import grp
+    import pwd
+    uid, gid = member.uid, member.gid
+    try:
+        if member.gname:
+            gid = grp.getgrnam(member.gname).gr_gid
+    except KeyError:
+        pass
+    try:
+        if member.uname:
+            uid = pwd.getpwnam(member.uname).pw_uid
+    except KeyError:
+        pass
+    return uid, gid
+
+
+def _can_link(reuse_path, size, mode, mtime, owner):
+    """Whether reuse_path can be linked as is: setting mode, mtime or owner on a link would change it too"""
+    if not reuse_path or os.path.islink(reuse_path):
+        return False
+    try:
+        st = os.stat(reuse_path)
+    except OSError:
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_size != size:
+        return False
+    if mode is not None and stat.S_IMODE(st.st_mode) != mode:
+        return False
+    if mtime is not None and st.st_mtime != mtime:
+        return False
+    return owner is None or (st.st_uid, st.st_gid) == owner
+
+
+def _write_file(source, target, size, reuse_path, result, mode=None, mtime=None, owner=None):
+    """Writes source to target, hard linking reuse_path instead if it has the very same content
+
+    Only files which already have the mode, mtime and owner the caller is going to
+    set are linked, the others are written. Returns the sha256 of the content and
+    whether target was linked. The comparison reads the old file while the new one
+    is streamed, nothing is written until the first difference.
+    """
+    chunk_size = settings.PATCHBOX_DOWNLOAD_CHUNK_SIZE
+    hasher = hashlib.sha256()
+    existing = None
+    out = None
+    matched = 0
+    linked = False
+    if _can_link(reuse_path, size, mode, mtime, owner):
+        existing = open(reuse_path, 'rb')
+    try:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            hasher.update(chunk)
+            if existing:
+                if existing.read(len(chunk)) == chunk:
+                    matched += len(chunk)
+                    continue
+                # Differs after all, write out the part that matched so far.
+                out = open(target, 'wb')
+                existing.seek(0)
+                out.write(existing.read(matched))
+                existing.close()
+                existing = None
+            if not out:
+                out = open(target, 'wb')
+            out.write(chunk)
+
+        result.files += 1
+        if existing:
+            try:
+                os.link(reuse_path, target)
+                linked = True
+            except OSError:
+                shutil.copyfile(reuse_path, target)
+            result.linked += 1
+            result.linked_bytes += size
+        else:
+            if not out:
+                out = open(target, 'wb')
+            result.written_bytes += size
+    finally:
+        if existing:
+            existing.close()
+        if out:
+            out.close()
+    return hasher.hexdigest(), linked
+
+
+def _open_zstd(f, path):
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard:
+        return zstandard.ZstdDecompressor().stream_reader(f), None
+    try:
+        process = subprocess.Popen(['zstd', '-dc', path], stdout=subprocess.PIPE)
+    except OSError:
+        raise ArchiveError('{}: zstd archives need the zstandard python package or the zstd tool'.format(path))
+    return process.stdout, process
+
+
+def _extract_tar_members(tar, dest, reuse_dir, result):
+    kwargs = {}
+    if hasattr(tarfile, 'fully_trusted_filter'):
+        # Members are already checked by _checked_tar_members, keep the same behavior on every python version.
+        kwargs['filter'] = 'fully_trusted'
+    directories = []
+    for member in _checked_tar_members(tar, dest):
+        target = os.path.join(dest, member.name)
+        if member.isfile():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            reuse_path = os.path.join(reuse_dir, member.name) if reuse_dir else None
+            digest, linked = _write_file(tar.extractfile(member), target, member.size, reuse_path, result,
+                                         mode=member.mode, mtime=member.mtime, owner=_tar_owner(member))
+            if not linked:
+                # A linked file already has these, and is shared with the installed version.
+                tar.chown(member, target, False)
+                tar.chmod(member, target)
+                tar.utime(member, target)
+            result.add(member.name, 'x' if member.mode & 0o111 else 'f', digest)
+            continue
+        if member.isdir():
+            # Attributes are set once everything is in, like extractall does, read-only folders stay writable until then.
+            directories.append(member)
+            result.add(member.name, 'd')
+        else:
+            result.add(member.name, 'l' if member.issym() else 'h', member.linkname)
+        tar.extract(member, dest, set_attrs=not member.isdir(), **kwargs)
+
+    for member in sorted(directories, key=lambda member: member.name, reverse=True):
+        target = os.path.join(dest, member.name)
+        tar.chown(member, target, False)
+        tar.utime(member, target)
+        tar.chmod(member, target)
+
+
+def _extract_tar(f, path, dest, reuse_dir, result):
+    process = None
+    fileobj = f
+    if f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+        fileobj, process = _open_zstd(f, path)
+    f.seek(0)
+
+    try:
+        # Stream mode reads the archive once, front to back, decompressing gz/bz2/xz on the fly.
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            _extract_tar_members(tar, dest, reuse_dir, result)
+    except BaseException:
+        if process:
+            process.kill()
+            process.wait()
+        raise
+    if process:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise ArchiveError('{}: zstd failed with exit code {}'.format(path, process.returncode))
+
+
+def _extract_zip(path, dest, reuse_dir, result):
+    with zipfile.ZipFile(path, 'r') as zip_file:
+        members = zip_file.infolist()
+        for member in members:
+            _check_path(dest, member.filename)
+        for member in members:
+            # Checked again now that the links extracted so far exist, like for tars.
+            _check_path(dest, member.filename)
+            target = os.path.join(dest, member.filename)
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+                result.add(member.filename, 'd')
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if stat.S_ISLNK(member.external_attr >> 16):
+                # Zipped with --symlinks, the content is the link target.
+                linkname = zip_file.read(member).decode('utf-8')
+                _check_path(dest, member.filename, os.path.join(os.path.dirname(member.filename), linkname))
+                os.symlink(linkname, target)
+                result.add(member.filename, 'l', linkname)
+                continue
+            reuse_path = os.path.join(reuse_dir, member.filename) if reuse_dir else None
+            # Keep the permissions (especially +x), but no setuid/setgid/sticky bits.
+            mode = (member.external_attr >> 16) & 0o777
+            with zip_file.open(member) as source:
+                digest, linked = _write_file(source, target, member.file_size, reuse_path, result, mode=mode or None)
+            if mode and not linked:
+                os.chmod(target, mode)
+            result.add(member.filename, 'x' if mode & 0o111 else 'f', digest)
+
+
+def extract_tar_stream(fileobj, dest, reuse_dir=None):
+    """Extracts an uncompressed tar stream, like the output of `git archive`, see extract_archive"""
+    dest = os.path.realpath(dest)
+    result = ExtractedArchive()
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        _extract_tar_members(tar, dest, reuse_dir, result)
+    return result
+
+
+def extract_archive(path, dest, reuse_dir=None):
+    """Extracts a zip or a (optionally gz/bz2/xz/zstd compressed) tar archive into dest in a single pass
+
+    Files identical to the ones at the same relative path under reuse_dir, metadata
+    included, are hard linked from there instead of being written. Returns an
+    ExtractedArchive.
+    """
+    dest = os.path.realpath(dest)
+    result = ExtractedArchive()
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        f.seek(0)
+        if magic in ZIP_MAGIC:
+            _extract_zip(path, dest, reuse_dir, result)
+            return result
+        try:
+            _extract_tar(f, path, dest, reuse_dir, result)
+            return result
+        except tarfile.ReadError:
+            pass
+    # Zips with data prepended (self extracting archives) don't start with the magic.
+    if zipfile.is_zipfile(path):
+        _extract_zip(path, dest, reuse_dir, result)
+        return result
+    raise ArchiveError('{} is not a valid file type: *.tar(.gz|.bz2|.xz|.zst) and *.zip files are supported'.format(path))
@@ -1,9 +1,15 @@
+import sys
+from patchbox import settings
+
+if '--startup-profile' in sys.argv:
+    from patchbox.startup import PatchboxStartupProfiler
+    startup_profiler = PatchboxStartupProfiler.install(settings.PATCHBOX_STARTUP_BUDGET_MS)
+else:
+    startup_profiler = None
+
 import click
 from patchbox.utils import PatchboxHomeGroup, PatchboxChoice, do_group_menu
-from patchbox import settings
-from dotenv import load_dotenv
 import os
-import sys
 import shutil
 
 click.Choice = PatchboxChoice
@@ -12,6 +18,10 @@ def migrate_state():
     if not os.path.exists(settings.PATCHBOX_STATE_DIR) and os.path.exists('/root/.patchbox'):
         shutil.move('/root/.patchbox', settings.PATCHBOX_STATE_DIR)
 
+def load_environment():
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=settings.PATCHBOX_ENVIRONMENT_FILE)
+
 def root_fix():
     if os.getuid() != 0:
         args = sys.argv
@@ -19,19 +29,29 @@ def root_fix():
         args.insert(1, '-E')
         os.execvp('sudo', args)
     else:
-        load_dotenv(dotenv_path='/etc/environment')
+        load_environment()
 
 @click.command(cls=PatchboxHomeGroup, context_settings=dict(help_option_names=['--help']))
 @click.option('--verbose', is_flag=True, help='Enables verbose mode.')
 @click.option('--interactive', is_flag=True, help='Enables interactive mode.')
 @click.option('--user', is_flag=True, help='Runs as current user instead of root', default=False)
+@click.option('--startup-profile', is_flag=True, help='Prints the time spent importing modules on startup.')
 @click.version_option("1.4.0")
 @click.pass_context
-def cli(ctx, verbose, interactive, user):
+def cli(ctx, verbose, interactive, user, startup_profile):
     """Patchbox Configuration Utility"""
-    if not user:
-        root_fix()
-        migrate_state()
+    ctx.meta['verbose'] = verbose
+    if not user and not ctx.meta.get('daemon'):
+        if os.getuid() != 0 and not interactive and ctx.invoked_subcommand and ctx.command.is_read_only(sys.argv[1:]):
+            # Read-only queries run as the invoking user, skipping the sudo re-exec.
+            ctx.meta['read_only'] = True
+            load_environment()
+        else:
+            root_fix()
+            migrate_state()
+
+    if startup_profiler:
+        startup_profiler.report()
 
     ctx.meta['is_user'] = user
 
@@ -40,4 +60,5 @@ def cli(ctx, verbose, interactive, user):
     do_group_menu(ctx, cancel='Exit')
 
 if __name__ == '__main__':
-    cli()
+    from patchbox.client import main
+    main()
@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import sys
+from patchbox import settings
+
+# Kept free of click and friends: when patchboxd is running, this is all the CLI imports.
+
+CLIENT_OPTIONS = ['--interactive', '--user', '--startup-profile', '--help', '--version']
+
+
+def get_daemon_command(argv):
+    for arg in argv:
+        if arg in CLIENT_OPTIONS:
+            return None
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
+def run_via_daemon(argv, socket_path=None):
+    """Runs the command in patchboxd, returns its exit code or None if it must run in-process"""
+    if get_daemon_command(argv) not in settings.PATCHBOX_DAEMON_COMMANDS:
+        return None
+
+    socket_path = socket_path or settings.PATCHBOX_DAEMON_SOCKET
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1.0)
+        sock.connect(socket_path)
+        sock.settimeout(None)
+    except OSError:
+        sock.close()
+        return None
+
+    try:
+        request = {'argv': argv, 'cwd': os.getcwd()}
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline().decode('utf-8'))
+    except (OSError, ValueError) as err:
+        # The command may have already run, so don't run it a second time in-process.
+        sys.stderr.write('Error: lost connection to patchboxd: {}\n'.format(err))
+        return 1
+    finally:
+        sock.close()
+
+    if response.get('fallback'):
+        return None
+
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stdout.flush()
+    sys.stderr.write(response.get('stderr', ''))
+    sys.stderr.flush()
+    return response.get('exit_code', 1)
+
+
+def main():
+    exit_code = run_via_daemon(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    from patchbox.cli import cli
+    cli()
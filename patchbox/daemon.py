@@ -0,0 +1,165 @@
+import grp
+import io
+import json
+import os
+import pwd
+import signal
+import socket
+import socketserver
+import struct
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+import click
+from patchbox import settings
+from patchbox.utils import InteractiveFallback
+
+
+class PatchboxDaemonRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        daemon = self.server.patchbox_daemon
+        argv = request.get('argv', [])
+        if not daemon.is_allowed(self.request):
+            response = {'stdout': '', 'stderr': 'Error: permission denied\n', 'exit_code': 1}
+        elif not daemon.is_read_only(argv):
+            # Anything changing the system runs in the client's own process, behind sudo.
+            response = {'fallback': True}
+        else:
+            response = daemon.run(argv, request.get('cwd'))
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class PatchboxDaemon(object):
+    """Keeps the environment, module manager and systemd connection in memory between commands
+
+    Only read-only commands are served, the client runs all others itself.
+    """
+
+    def __init__(self, socket_path=None, group=None):
+        self.socket_path = socket_path or settings.PATCHBOX_DAEMON_SOCKET
+        self.group = group or settings.PATCHBOX_DAEMON_GROUP
+        self._environment_stat = None
+        self._module_manager = None
+
+    def is_allowed(self, conn):
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', creds)
+        if uid == 0:
+            return True
+        try:
+            group = grp.getgrnam(self.group)
+            return gid == group.gr_gid or pwd.getpwuid(uid).pw_name in group.gr_mem
+        except KeyError:
+            return False
+
+    @staticmethod
+    def is_read_only(argv):
+        from patchbox.cli import cli
+        return cli.is_read_only(list(argv))
+
+    def load_environment(self):
+        try:
+            st = os.stat(settings.PATCHBOX_ENVIRONMENT_FILE)
+        except OSError:
+            return
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key != self._environment_stat:
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path=settings.PATCHBOX_ENVIRONMENT_FILE, override=True)
+            self._environment_stat = key
+
+    def get_module_manager(self):
+        from patchbox.module import PatchboxModuleManager
+        from patchbox.service import PatchboxServiceManager
+        if self._module_manager is None:
+            self._module_manager = PatchboxModuleManager(service_manager=PatchboxServiceManager(cache_properties=True))
+        else:
+            self._module_manager.refresh()
+        return self._module_manager
+
+    def run(self, argv, cwd=None):
+        from patchbox.cli import cli
+
+        self.load_environment()
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = 0
+        prev_cwd = os.getcwd()
+        try:
+            if cwd:
+                os.chdir(cwd)
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    with cli.make_context('patchbox', list(argv)) as ctx:
+                        ctx.meta['daemon'] = self
+                        ctx.meta['module_manager'] = self.get_module_manager()
+                        cli.invoke(ctx)
+                except InteractiveFallback:
+                    return {'fallback': True}
+                except click.ClickException as err:
+                    err.show()
+                    exit_code = err.exit_code
+                except click.exceptions.Exit as err:
+                    exit_code = err.exit_code
+                except click.Abort:
+                    print('Aborted!', file=sys.stderr)
+                    exit_code = 1
+                except SystemExit as err:
+                    exit_code = err.code if isinstance(err.code, int) else 1
+                except Exception as err:
+                    print('Error: {}'.format(err), file=sys.stderr)
+                    exit_code = 1
+        finally:
+            os.chdir(prev_cwd)
+
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code}
+
+    def _create_socket_dir(self):
+        socket_dir = os.path.dirname(self.socket_path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def serve_forever(self):
+        # Pay the import and connection costs once, up front.
+        from patchbox.cli import cli
+        cli.list_commands(None)
+        self.load_environment()
+        self.get_module_manager()
+
+        self._create_socket_dir()
+        umask = os.umask(0o117)
+        try:
+            server = socketserver.UnixStreamServer(self.socket_path, PatchboxDaemonRequestHandler)
+        finally:
+            os.umask(umask)
+        server.patchbox_daemon = self
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            try:
+                os.chown(self.socket_path, 0, grp.getgrnam(self.group).gr_gid)
+                os.chmod(self.socket_path, 0o660)
+            except KeyError:
+                os.chmod(self.socket_path, 0o600)
+            print('Daemon: listening on {}'.format(self.socket_path))
+            sys.stdout.flush()
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def main():
+    if os.getuid() != 0:
+        print('Error: patchboxd must be run as root', file=sys.stderr)
+        sys.exit(1)
+    try:
+        PatchboxDaemon().serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,113 @@
+import hashlib
+import time
+from patchbox import settings
+
+
+class DownloadError(Exception):
+    pass
+
+
+def parse_checksum(checksum):
+    """Splits 'sha256:<hex>' (or a bare sha256 hex digest) into (algorithm, digest)"""
+    algorithm, sep, digest = checksum.partition(':')
+    if not sep:
+        algorithm, digest = 'sha256', checksum
+    algorithm = algorithm.lower()
+    if algorithm not in hashlib.algorithms_available:
+        raise DownloadError('unsupported checksum algorithm: {}'.format(algorithm))
+    return algorithm, digest.lower()
+
+
+def file_digest(path, algorithm='sha256', chunk_size=None):
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size or settings.PATCHBOX_DOWNLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def verify_file(path, checksum, chunk_size=None):
+    """Raises DownloadError if the hash of the file at path doesn't match checksum, returns the digest otherwise"""
+    algorithm, expected = parse_checksum(checksum)
+    digest = file_digest(path, algorithm, chunk_size)
+    if digest != expected:
+        raise DownloadError('{} checksum mismatch: expected {}, got {}'.format(path, expected, digest))
+    return digest
+
+
+class PatchboxDownload(object):
+    """Streams a URL into a file, hashing while writing and resuming after dropped connections"""
+
+    def __init__(self, url, file, checksum=None, chunk_size=None, timeout=None, retries=None):
+        self.url = url
+        self.file = file
+        self.checksum = checksum
+        self.chunk_size = chunk_size or settings.PATCHBOX_DOWNLOAD_CHUNK_SIZE
+        self.timeout = timeout or settings.PATCHBOX_DOWNLOAD_TIMEOUT
+        self.retries = settings.PATCHBOX_DOWNLOAD_RETRIES if retries is None else retries
+        self.algorithm, self.expected = parse_checksum(checksum) if checksum else ('sha256', None)
+        self.size = 0
+        self.total = None
+        self.resumes = 0
+
+    def _restart(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.size = 0
+        self._hasher = hashlib.new(self.algorithm)
+
+    def _request(self, requests):
+        headers = {}
+        if self.size:
+            headers['Range'] = 'bytes={}-'.format(self.size)
+        with requests.get(self.url, stream=True, timeout=self.timeout, headers=headers) as r:
+            if r.status_code == 206 and self.size:
+                content_range = r.headers.get('Content-Range', '')
+                if not content_range.startswith('bytes {}-'.format(self.size)):
+                    raise DownloadError('{} returned an unexpected range: {}'.format(self.url, content_range))
+                self.total = int(content_range.rpartition('/')[2]) if not content_range.endswith('/*') else None
+            elif r.status_code == 200:
+                if self.size:
+                    print('Download: server does not support resuming, starting over')
+                    self._restart()
+                length = r.headers.get('Content-Length')
+                self.total = int(length) if length and not r.headers.get('Content-Encoding') else None
+            else:
+                raise DownloadError('{} returned status code {}'.format(self.url, r.status_code))
+
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                self.file.write(chunk)
+                self._hasher.update(chunk)
+                self.size += len(chunk)
+
+        if self.total is not None and self.size < self.total:
+            raise requests.exceptions.ConnectionError('connection closed at {} of {} bytes'.format(self.size, self.total))
+
+    def run(self):
+        """Downloads the file, returns the hex digest of its contents"""
+        import requests
+
+        self._restart()
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                self._request(requests)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadError('{} download failed: {}'.format(self.url, err))
+                self.resumes += 1
+                print('Download: connection lost at {} bytes, resuming ({}/{})'.format(self.size, attempt, self.retries))
+                time.sleep(min(attempt, 5))
+        self.file.flush()
+
+        digest = self._hasher.hexdigest()
+        elapsed = max(time.monotonic() - start, 1e-6)
+        print('Download: {} bytes in {:.1f} s ({:.1f} KiB/s), {} {}'.format(
+            self.size, elapsed, self.size / elapsed / 1024.0, self.algorithm, digest))
+        if self.expected and digest != self.expected:
+            raise DownloadError('{} checksum mismatch: expected {}, got {}'.format(self.url, self.expected, digest))
+        return digest
@@ -1,47 +1,159 @@
+import os
+from contextlib import contextmanager
+from patchbox import settings
+from patchbox.lock import PatchboxFileLock
+
+
 class PatchboxEnvironment(object):
 
+    PATH = settings.PATCHBOX_ENVIRONMENT_FILE
+    LOCK = PatchboxFileLock(settings.PATCHBOX_ENVIRONMENT_LOCK)
+
+    # (stat key, lines, values) of the last read, reused until the file changes.
+    _cache = None
+    # {param: value} set within batch() and not written yet.
+    _pending = None
+    _batch_depth = 0
+
+    @staticmethod
+    def _get_stat():
+        try:
+            st = os.stat(PatchboxEnvironment.PATH)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def parse(lines):
+        values = {}
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, sep, value = line.partition('=')
+            if sep:
+                values.setdefault(key.strip(), value.strip())
+        return values
+
+    @staticmethod
+    def _load():
+        cache = PatchboxEnvironment._cache
+        stat = PatchboxEnvironment._get_stat()
+        if cache is not None and cache[0] == stat:
+            return cache
+        # The file is only ever replaced with a rename, reading it needs no lock.
+        try:
+            with open(PatchboxEnvironment.PATH, 'rt') as f:
+                st = os.fstat(f.fileno())
+                stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+                lines = f.readlines()
+        except IOError:
+            stat = None
+            lines = []
+        PatchboxEnvironment._cache = (stat, lines, PatchboxEnvironment.parse(lines))
+        return PatchboxEnvironment._cache
+
+    @staticmethod
+    def _write(lines):
+        # Replace the file in one rename, keeping the ownership and mode of the original.
+        path = PatchboxEnvironment.PATH
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                st = os.stat(path)
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+                os.chmod(tmp_path, st.st_mode & 0o7777)
+            except OSError:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        PatchboxEnvironment._cache = (PatchboxEnvironment._get_stat(), lines, PatchboxEnvironment.parse(lines))
+
+    @staticmethod
+    @contextmanager
+    def batch():
+        """Collects the set() calls made within the block into a single rewrite, done by flush() or at its end"""
+        if not PatchboxEnvironment._batch_depth:
+            PatchboxEnvironment._pending = {}
+        PatchboxEnvironment._batch_depth += 1
+        try:
+            yield
+        finally:
+            PatchboxEnvironment._batch_depth -= 1
+            if not PatchboxEnvironment._batch_depth:
+                PatchboxEnvironment.flush()
+                PatchboxEnvironment._pending = None
+
+    @staticmethod
+    def flush():
+        """Writes the changes collected by the current batch, services read the file when they start"""
+        pending = PatchboxEnvironment._pending
+        if pending:
+            PatchboxEnvironment._pending = {}
+            PatchboxEnvironment.set_many(pending)
+
     @staticmethod
     def get(param, debug=True):
         param = str(param)
-
-        with open('/etc/environment', 'rt') as f:
-            for line in f:
-                if len(line.strip()) != 0:
-                    if line.startswith(param):
-                        value = line.split('=')[-1].strip()
-                        if debug:
-                            print('Environment: get {}={}'.format(param, value))
-                        return value
+        pending = PatchboxEnvironment._pending
+        if pending and param in pending:
+            value = pending[param]
+        else:
+            value = PatchboxEnvironment._load()[2].get(param)
         if debug:
-            print('Environment: get {}={}'.format(param, None))
-        return None
+            print('Environment: get {}={}'.format(param, value))
+        return value
 
     @staticmethod
     def set(param, value, debug=True):
-        with open('/etc/environment', 'rt') as f:
-            data = f.readlines()
-            changed = None
-            for i, line in enumerate(data):
-                if line.startswith(param):
-                    current_value = line.split('=')[-1].strip()
+        if PatchboxEnvironment._pending is not None:
+            PatchboxEnvironment._pending[str(param)] = value
+            return
+        PatchboxEnvironment.set_many({param: value}, debug=debug)
+
+    @staticmethod
+    def set_many(changes, debug=True):
+        """Applies {param: value} changes in a single rewrite, a None value unsets the param"""
+        with PatchboxEnvironment.LOCK.exclusive():
+            data = list(PatchboxEnvironment._load()[1])
+            changed = False
+            for param, value in changes.items():
+                param = str(param)
+                index = None
+                for i, line in enumerate(data):
+                    key, sep, current_value = line.strip().partition('=')
+                    if sep and key.strip() == param:
+                        index = i
+                        current_value = current_value.strip()
+                        break
+                if index is not None:
                     if current_value == value:
                         if debug:
                             print('Environment: {} {} -> {} (skip)'.format(param, current_value, value))
-                        return
+                        continue
                     if value:
                         if debug:
                             print('Environment: {} {} -> {}'.format(param, current_value, value))
-                        data[i] = '{}={}\n'.format(param, value)
+                        data[index] = '{}={}\n'.format(param, value)
                     else:
                         if debug:
                             print('Environment: {} {} -> unset'.format(param, current_value))
-                        del data[i]
+                        del data[index]
                     changed = True
-                    break
-            if not changed and value:
-                if debug:
-                    print('Environment: {} unset -> {}'.format(param, value))
-                data.append('{}={}\n'.format(param, value))
-
-        with open('/etc/environment', 'w') as f:
-            f.writelines(data)
+                elif value:
+                    if debug:
+                        print('Environment: {} unset -> {}'.format(param, value))
+                    if data and not data[-1].endswith('\n'):
+                        data[-1] += '\n'
+                    data.append('{}={}\n'.format(param, value))
+                    changed = True
+
+            if changed:
+                PatchboxEnvironment._write(data)
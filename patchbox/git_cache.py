@@ -0,0 +1,72 @@
+import hashlib
+import os
+import re
+import subprocess
+from shutil import rmtree
+from patchbox.lock import PatchboxFileLock
+from patchbox import settings
+
+
+class GitError(Exception):
+    pass
+
+
+def split_ref(url):
+    """Splits 'url#ref' into (url, ref), ref is None when the source isn't pinned"""
+    base, sep, ref = url.rpartition('#')
+    if not sep:
+        return url, None
+    return base, ref or None
+
+
+class PatchboxGitCache(object):
+    """Shallow bare mirrors of git module sources, re-installs and upgrades only fetch new objects"""
+
+    def __init__(self, path=None):
+        self.path = path or settings.PATCHBOX_GIT_CACHE
+
+    @staticmethod
+    def _env():
+        # Never prompt for credentials, installs may run without a terminal.
+        return dict(os.environ, GIT_TERMINAL_PROMPT='0', GIT_ASKPASS='true')
+
+    def _git(self, args, cwd=None):
+        try:
+            return subprocess.check_output(['git'] + args, cwd=cwd, env=self._env(), universal_newlines=True)
+        except subprocess.CalledProcessError as err:
+            raise GitError('git {} failed with exit code {}'.format(args[0], err.returncode))
+        except OSError as err:
+            raise GitError('git is not available: {}'.format(err))
+
+    def get_repo_path(self, url):
+        name = re.sub(r'[^\w.-]', '_', os.path.basename(url.rstrip('/'))) or 'repo'
+        return os.path.join(self.path, '{}-{}'.format(name, hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]))
+
+    def _create(self, url, repo):
+        tmp_repo = '{}.{}.tmp'.format(repo, os.getpid())
+        try:
+            self._git(['init', '--quiet', '--bare', tmp_repo])
+            self._git(['remote', 'add', 'origin', url], cwd=tmp_repo)
+            os.rename(tmp_repo, repo)
+        finally:
+            if os.path.exists(tmp_repo):
+                rmtree(tmp_repo)
+
+    def fetch(self, url, ref=None):
+        """Fetches ref (the remote's HEAD by default) with depth 1, returns its commit id"""
+        repo = self.get_repo_path(url)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        local_ref = 'refs/patchbox/{}'.format(ref or 'HEAD')
+        with PatchboxFileLock(repo + '.lock').exclusive():
+            if not os.path.isdir(repo):
+                self._create(url, repo)
+            print('Git: fetching {} of {}'.format(ref or 'HEAD', url))
+            self._git(['fetch', '--quiet', '--depth', '1', '--no-tags', 'origin',
+                       '+{}:{}'.format(ref or 'HEAD', local_ref)], cwd=repo)
+            return self._git(['rev-parse', local_ref + '^{commit}'], cwd=repo).strip()
+
+    def archive(self, url, commit, prefix):
+        """Starts `git archive` of commit, the tar stream is read from the returned process's stdout"""
+        return subprocess.Popen(['git', 'archive', '--format=tar', '--prefix=' + prefix, commit],
+                                cwd=self.get_repo_path(url), env=self._env(), stdout=subprocess.PIPE)
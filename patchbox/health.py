@@ -0,0 +1,312 @@
+import os
+import socket
+import subprocess
+import time
+from patchbox.module import ModuleError, ModuleManagerError, ModuleNotFound
+from patchbox.service import ServiceError, ServiceManagerError
+from patchbox import settings
+
+
+class HealthError(Exception):
+    pass
+
+
+def _as_list(value):
+    if value is None or value is False:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class PatchboxHealthCheck(object):
+    """The checks declared in the "health" section of patchbox-module.json
+
+    "process": true for anything still running from the launch, or process names
+    "port": TCP ports (or "host:port") which must accept connections
+    "socket": paths of Unix sockets which must accept connections
+    "probe": script in the module folder which must exit with 0
+    "services": whether the module's services must be active, true by default
+    "interval", "timeout", "grace": seconds, "failures": failed checks in a row before a restart
+    """
+
+    def __init__(self, module, launch_unit=None, launch_pid=None):
+        health = module.data.get('health')
+        if not isinstance(health, dict):
+            raise HealthError('{}.module "health" must be an object'.format(module.name))
+        self.module = module
+        self.launch_unit = launch_unit
+        self.launch_pid = launch_pid
+        try:
+            self.interval = float(health.get('interval', settings.PATCHBOX_HEALTH_INTERVAL))
+            self.timeout = float(health.get('timeout', settings.PATCHBOX_HEALTH_TIMEOUT))
+            self.grace = float(health.get('grace', settings.PATCHBOX_HEALTH_GRACE))
+            self.failures = max(int(health.get('failures', settings.PATCHBOX_HEALTH_FAILURES)), 1)
+            self.ports = [self._parse_port(port) for port in _as_list(health.get('port'))]
+        except (TypeError, ValueError) as err:
+            raise HealthError('{}.module "health" is not valid: {}'.format(module.name, err))
+        self.processes = _as_list(health.get('process'))
+        self.sockets = [str(path) for path in _as_list(health.get('socket'))]
+        self.probe = os.path.join(module.path, health['probe']) if health.get('probe') else None
+        self.services = []
+        if health.get('services', True):
+            self.services = module.get_system_services(fail_silent=True) + \
+                [service for service in module.get_module_services(fail_silent=True) if service.auto_start]
+
+    @staticmethod
+    def _parse_port(port):
+        host, sep, port = str(port).rpartition(':')
+        return (host if sep else 'localhost'), int(port)
+
+    def _check_units(self, service_manager):
+        names = [service.name for service in self.services]
+        if self.launch_unit:
+            names.append(self.launch_unit)
+        if not names:
+            return []
+        units = service_manager.get_units_status(names, unit_files=False)
+        return ['{} is {}'.format(name, units[name]['active_state'])
+                for name in names if units[name]['active_state'] not in ['active', 'activating', 'reloading']]
+
+    @staticmethod
+    def _get_process_names(pids=None):
+        if pids is None:
+            pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+        names = set()
+        for pid in pids:
+            try:
+                with open('/proc/{}/comm'.format(pid), 'rt') as f:
+                    names.add(f.read().strip())
+            except (IOError, OSError):
+                # Exited in the meantime.
+                continue
+        return names
+
+    @staticmethod
+    def _get_session_pids(sid):
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry), 'rt') as f:
+                    # The process name may contain spaces and parentheses, the fields after it don't.
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except (IOError, OSError, IndexError):
+                continue
+            # state, ppid, pgrp, session
+            if len(fields) > 3 and fields[3] == str(sid) and fields[0] != 'Z':
+                pids.append(int(entry))
+        return pids
+
+    def _check_processes(self, service_manager):
+        failures = []
+        # Processes are looked for among the launch's own ones: the launch unit's cgroup, or the session
+        # a launch without a unit was started in. Only without either the whole system is scanned.
+        pids = None
+        if self.launch_unit:
+            pids = service_manager.get_unit_pids(self.launch_unit)
+            launch = self.launch_unit
+        elif self.launch_pid:
+            pids = self._get_session_pids(self.launch_pid)
+            launch = 'the session of process {}'.format(self.launch_pid)
+        if True in self.processes and pids == []:
+            failures.append('nothing is running in {}'.format(launch))
+        names = [str(name) for name in self.processes if name is not True]
+        if names:
+            running = self._get_process_names(pids)
+            # The kernel truncates process names to 15 characters.
+            failures += ['process {} is not running'.format(name) for name in names if name[:15] not in running]
+        return failures
+
+    def _check_connect(self, family, address):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(address)
+            return None
+        except OSError as err:
+            return err.strerror or str(err)
+        finally:
+            sock.close()
+
+    def _check_probe(self):
+        try:
+            code = subprocess.call(['sh', self.probe], cwd=self.module.path, timeout=self.timeout,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        except subprocess.TimeoutExpired:
+            return 'probe timed out after {:.0f} s'.format(self.timeout)
+        except OSError as err:
+            return 'probe failed to run: {}'.format(err)
+        return 'probe exited with {}'.format(code) if code else None
+
+    def run(self, service_manager):
+        """Returns the reasons the module is unhealthy, an empty list if it is healthy"""
+        failures = self._check_units(service_manager)
+        if failures:
+            # Whatever depends on a stopped unit would fail too, there's no need to probe it.
+            return failures
+        if self.processes:
+            failures += self._check_processes(service_manager)
+        for host, port in self.ports:
+            error = self._check_connect(socket.AF_INET, (host, port))
+            if error:
+                failures.append('port {}:{} is not reachable: {}'.format(host, port, error))
+        for path in self.sockets:
+            error = self._check_connect(socket.AF_UNIX, path)
+            if error:
+                failures.append('socket {} is not reachable: {}'.format(path, error))
+        if self.probe and not failures:
+            error = self._check_probe()
+            if error:
+                failures.append(error)
+        return failures
+
+
+class PatchboxModuleWatcher(object):
+    """Runs the health checks of the active module and restarts it with exponential backoff when they fail
+
+    Only modules with a "health" section are watched. Crashes are counted in the
+    module's state, a module stopped with `module stop` is left alone.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._module_path = None
+        self._reset(None)
+
+    def _reset(self, module):
+        self._module = module
+        self._check = None
+        self._failures = 0
+        self._restarts = 0
+        self._restarted_at = None
+        self._restart_at = None
+        self._grace_until = 0
+        self._health = None
+
+    @staticmethod
+    def get_backoff(restarts):
+        """Seconds to wait before the next restart: none for the first one, then doubling up to the maximum"""
+        if not restarts:
+            return 0
+        return min(settings.PATCHBOX_HEALTH_BACKOFF_MIN * 2 ** (restarts - 1), settings.PATCHBOX_HEALTH_BACKOFF_MAX)
+
+    def _start(self, path):
+        self._module_path = path
+        self._reset(None)
+        if not path:
+            return
+        try:
+            module = self.manager.get_module_by_path(path)
+        except (ModuleError, ModuleNotFound) as err:
+            print('Watch: ERROR: {}'.format(err))
+            return
+        self._module = module
+        if not module.data.get('health'):
+            return
+        if module.is_desktop:
+            print('Watch: {}.module is a desktop module, it is not watched'.format(module.name))
+            return
+        try:
+            self._check = PatchboxHealthCheck(module)
+        except HealthError as err:
+            print('Watch: ERROR: {}'.format(err))
+            return
+        self._grace_until = time.monotonic() + self._check.grace
+        print('Watch: watching {}.module every {:g} s'.format(module.name, self._check.interval))
+
+    def _update_launch(self):
+        # Follows how the module was actually launched, a launch falling back to a plain process has no unit.
+        module = self._module
+        if module.has_launch and module.autolaunch:
+            self._check.launch_unit = self.manager._get_launch_unit(module)
+            self._check.launch_pid = self.manager.state.get('launch_pid', module.path)
+        else:
+            self._check.launch_unit = self._check.launch_pid = None
+
+    def _set_health(self, health):
+        # Only changes are written, not every check.
+        if health != self._health:
+            self.manager.state.set('health', health, self._module.path)
+            self._health = health
+
+    def _record_crash(self, failures):
+        state = self.manager.state
+        path = self._module.path
+        with state.transaction():
+            state.set('crash_count', (state.get('crash_count', path) or 0) + 1, path)
+            state.set('last_crash_time', int(time.time()), path)
+            state.set('last_crash_reason', '; '.join(failures), path)
+            self._set_health('restarting')
+
+    def _restart(self):
+        print('Watch: restarting {}.module (restart {} in a row)'.format(self._module.name, self._restarts + 1))
+        try:
+            self.manager.restart(self._module)
+        except (ModuleError, ModuleManagerError, ServiceError, ServiceManagerError) as err:
+            print('Watch: ERROR: {}'.format(err))
+        self._restarts += 1
+        self._restarted_at = time.monotonic()
+        self._restart_at = None
+        self._failures = 0
+        self._grace_until = self._restarted_at + self._check.grace
+
+    def tick(self):
+        """Checks the active module once, restarting it if needed, returns the seconds until the next check"""
+        self.manager.refresh()
+        path = self.manager.get_active_module_path()
+        if path != self._module_path:
+            self._start(path)
+        if not self._check:
+            return settings.PATCHBOX_HEALTH_INTERVAL
+
+        name = self._module.name
+        now = time.monotonic()
+        if self.manager.state.get('stopped', path):
+            self._failures = 0
+            self._restart_at = None
+            self._set_health('stopped')
+            return self._check.interval
+        if self._health == 'stopped':
+            # Launched again, give it the same time to come up as after a restart.
+            self._health = None
+            self._grace_until = now + self._check.grace
+        if now < self._grace_until:
+            return min(self._check.interval, self._grace_until - now)
+
+        self._update_launch()
+        failures = self._check.run(self.manager._service_manager)
+        if not failures:
+            if self._failures:
+                print('Watch: {}.module is healthy again'.format(name))
+            self._failures = 0
+            self._restart_at = None
+            self._set_health('ok')
+            if self._restarts and now - self._restarted_at >= settings.PATCHBOX_HEALTH_STABLE_TIME:
+                self._restarts = 0
+            return self._check.interval
+
+        self._failures += 1
+        print('Watch: {}.module check failed ({}/{}): {}'.format(name, self._failures, self._check.failures, '; '.join(failures)))
+        if self._failures < self._check.failures:
+            self._set_health('failing')
+            return self._check.interval
+
+        if self._restart_at is None:
+            self._record_crash(failures)
+            delay = self.get_backoff(self._restarts)
+            self._restart_at = now + delay
+            if delay:
+                print('Watch: restarting {}.module in {:g} s'.format(name, delay))
+        if now < self._restart_at:
+            # Still checked while waiting, a module which recovers on its own isn't restarted.
+            return min(self._check.interval, self._restart_at - now)
+
+        self._restart()
+        return self._check.interval
+
+    def run(self, once=False):
+        while True:
+            delay = self.tick()
+            if once:
+                return
+            time.sleep(delay)
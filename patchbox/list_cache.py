@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+from patchbox import settings
+
+
+class PatchboxListCache(object):
+    """Saved output of module list scripts, one file per module
+
+    An entry is valid while the module version, the list script and the mtimes of
+    the paths the module declares in "list_watch" are unchanged.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path or settings.PATCHBOX_LIST_CACHE_FOLDER
+
+    def _get_file(self, module):
+        return os.path.join(self.path, '{}-{}.json'.format(
+            module.name, hashlib.sha1(module.path.encode('utf-8')).hexdigest()[:8]))
+
+    @staticmethod
+    def _get_mtime(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size] if not os.path.isdir(path) else [st.st_mtime_ns]
+
+    @staticmethod
+    def get_watched_paths(module):
+        watch = module.data.get('list_watch') or []
+        if not isinstance(watch, list):
+            watch = [watch]
+        return [os.path.join(module.path, str(path)) for path in watch]
+
+    def get_key(self, module):
+        return {
+            'version': module.version,
+            'script': self._get_mtime(os.path.join(module.path, module.has_list)),
+            'watch': dict((path, self._get_mtime(path)) for path in self.get_watched_paths(module))
+        }
+
+    def _read(self, module):
+        try:
+            with open(self._get_file(module), 'rt') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data.get('version') != self.__class__.VERSION:
+            return None
+        return data
+
+    def get(self, module):
+        """Returns the cached items, None if there are none or they are out of date"""
+        data = self._read(module)
+        if not data:
+            return None
+        if data.get('key') != self.get_key(module):
+            return None
+        return data.get('items')
+
+    def set(self, module, key, items):
+        path = self._get_file(module)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(tmp_path, 'wt') as f:
+                json.dump({'version': self.__class__.VERSION, 'key': key, 'items': items}, f)
+            os.replace(tmp_path, path)
+        except (IOError, OSError):
+            # Unprivileged processes can't write the cache, they just don't get to update it.
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,75 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+class LockError(Exception):
+    pass
+
+
+class PatchboxFileLock(object):
+    """Re-entrant advisory lock, taken with flock() on a separate lock file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._depth = 0
+        self._exclusive = False
+
+    def _open(self):
+        lock_dir = os.path.dirname(self.path)
+        if lock_dir and not os.path.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir, exist_ok=True)
+            except OSError:
+                pass
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            pass
+        try:
+            # flock() doesn't need write access, so unprivileged processes can still take part.
+            return os.open(self.path, os.O_RDONLY)
+        except OSError as err:
+            raise LockError('can\'t open lock file {}: {}'.format(self.path, err))
+
+    def acquire(self, exclusive=True):
+        """Blocks until the lock is held, raises LockError if the lock file can't be opened or created"""
+        if self._depth:
+            self._depth += 1
+            if exclusive and not self._exclusive:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                self._exclusive = True
+            return True
+
+        self._fd = self._open()
+        self._depth = 1
+        self._exclusive = exclusive
+        fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return True
+
+    def release(self):
+        if not self._depth:
+            return
+        self._depth -= 1
+        if self._depth:
+            return
+        os.close(self._fd)
+        self._fd = None
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self):
+        self.acquire(exclusive=False)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire(exclusive=True)
+        try:
+            yield self
+        finally:
+            self.release()
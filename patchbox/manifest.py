@@ -0,0 +1,145 @@
+import json
+import os
+import click
+from patchbox import settings
+
+
+class PatchboxCommandManifest(object):
+    """Cached description of the commands found in patchbox/modules/*/cli.py"""
+
+    VERSION = 2
+
+    def __init__(self, modules_folder, paths=None):
+        self.modules_folder = modules_folder
+        self.paths = paths or [settings.PATCHBOX_CLI_MANIFEST, settings.PATCHBOX_CLI_MANIFEST_USER]
+        self._data = None
+
+    def _get_sources(self):
+        sources = {}
+        for entry in os.scandir(self.modules_folder):
+            if not entry.is_dir():
+                continue
+            try:
+                st = os.stat(os.path.join(entry.path, 'cli.py'))
+            except OSError:
+                continue
+            sources[entry.name] = [st.st_mtime_ns, st.st_size]
+        return sources
+
+    def _load(self, sources):
+        for path in self.paths:
+            try:
+                with open(path, 'rt') as f:
+                    data = json.load(f)
+            except (IOError, ValueError):
+                continue
+            if data.get('version') == self.__class__.VERSION and data.get('sources') == sources:
+                return data
+        return None
+
+    def _save(self, data):
+        for path in self.paths:
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, 'wt') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, path)
+                return True
+            except (IOError, OSError):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return False
+
+    @property
+    def data(self):
+        if self._data is None:
+            sources = self._get_sources()
+            self._data = self._load(sources)
+            if self._data is None:
+                self._data = self.generate(sources)
+                self._save(self._data)
+        return self._data
+
+    def generate(self, sources=None):
+        sources = sources if sources is not None else self._get_sources()
+        commands = {}
+        for name in sources:
+            try:
+                mod = __import__('patchbox.modules.{}.cli'.format(name), None, None, ['cli'])
+                commands[name] = self.describe_command(mod.cli, name)
+            except Exception:
+                # Described on the next run, the error surfaces when the command is invoked.
+                sources[name] = None
+                commands[name] = {'name': name, 'doc': None, 'help': None, 'short_help': None, 'hidden': False, 'read_only': False, 'params': []}
+        return {'version': self.__class__.VERSION, 'sources': sources, 'commands': commands}
+
+    @staticmethod
+    def describe_param(param):
+        info = {
+            'name': param.name,
+            'opts': param.opts,
+            'type': param.type.name,
+            'help': getattr(param, 'help', None),
+            'required': param.required,
+            'is_flag': getattr(param, 'is_flag', False),
+            'choices': None,
+            'choices_provider': None
+        }
+        choices = getattr(param.type, 'choices', None)
+        if callable(choices):
+            info['choices_provider'] = '{}:{}'.format(choices.__module__, choices.__qualname__)
+        elif choices is not None:
+            info['choices'] = list(choices)
+        return info
+
+    @staticmethod
+    def describe_command(cmd, name=None):
+        info = {
+            'name': name or cmd.name,
+            'doc': cmd.__doc__,
+            'help': cmd.help,
+            'short_help': cmd.short_help,
+            'hidden': cmd.hidden,
+            'read_only': getattr(cmd.callback, '__patchbox_read_only__', False),
+            'params': [PatchboxCommandManifest.describe_param(p) for p in cmd.params]
+        }
+        if isinstance(cmd, click.MultiCommand):
+            ctx = click.Context(cmd, info_name=info['name'])
+            info['commands'] = {}
+            for sub_name in cmd.list_commands(ctx):
+                sub_cmd = cmd.get_command(ctx, sub_name)
+                if sub_cmd is not None:
+                    info['commands'][sub_name] = PatchboxCommandManifest.describe_command(sub_cmd, sub_name)
+        return info
+
+    def get_names(self):
+        return sorted(self.data.get('commands'))
+
+    def resolve(self, args):
+        """Returns the description of the command invoked by the given arguments"""
+        path = []
+        info = None
+        for arg in args:
+            if arg.startswith('-'):
+                continue
+            sub_info = self.get_command(path + [arg])
+            if sub_info is None:
+                break
+            path.append(arg)
+            info = sub_info
+        return info
+
+    def get_command(self, path):
+        if isinstance(path, str):
+            path = [path]
+        commands = self.data.get('commands')
+        info = None
+        for name in path:
+            info = (commands or {}).get(name)
+            if info is None:
+                return None
+            commands = info.get('commands')
+        return info
@@ -1,18 +1,19 @@
 import subprocess
 import json
 import os
-import requests
-from shutil import rmtree, copytree, Error as shutil_error
-from collections import defaultdict
-import glob
-import zipfile
-import tarfile
+import re
+from shutil import rmtree
+import functools
+import time
+from contextlib import contextmanager
 import urllib
 from urllib.parse import urlparse
 from pathlib import Path
-import tempfile
 from enum import Enum
 from patchbox.state import PatchboxModuleStateManager
+from patchbox.environment import PatchboxEnvironment as penviron
+from patchbox.module_index import PatchboxModuleIndex
+from patchbox.list_cache import PatchboxListCache
 from patchbox.service import PatchboxServiceManager, PatchboxService, ServiceError
 from patchbox import settings
 
@@ -23,6 +24,20 @@ except ImportError:
     DEVNULL = open(os.devnull, 'wb')
 
 
+def manager_operation(transaction=True):
+    """Commits all state and environment changes and coalesced service restarts of a manager operation at its end"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._service_manager.operation(method.__name__):
+                if not transaction:
+                    return method(self, *args, **kwargs)
+                with self.state.transaction(), penviron.batch(), self._service_manager.restart_transaction():
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class ModuleNotInstalled(Exception):
     def __init__(self, module_name, *args):
         self.message = '{}.module is not installed: activate it first'.format(
@@ -57,21 +72,48 @@ class ModuleManagerError(Exception):
         print('Manager: {} directory deleted'.format(remove_dir))
 
 
+class PatchboxModuleInstall(object):
+    """One source of a module install, and how installing it went"""
+
+    def __init__(self, path, checksum=None):
+        self.path = path
+        self.checksum = checksum
+        self.source = None
+        self.content_hash = None
+        self.staging_dir = None
+        self.module = None
+        # pending, installed, unchanged, skipped or failed
+        self.status = 'pending'
+        self.error = None
+        self.output = None
+        self.timings = {}
+
+    @property
+    def name(self):
+        return self.module.name if self.module else self.path
+
+    def fail(self, err):
+        self.status = 'failed'
+        self.error = str(err)
+
+
 class PatchboxModule(object):
 
     PATCHBOX_MODULE_FILE = settings.PATCHBOX_MODULE_FILE
     PATCHBOX_MODULE_REQUIRED_KEYS = settings.PATCHBOX_MODULE_REQUIRED_KEYS
 
-    def __init__(self, path):
+    def __init__(self, path, data=None):
         self.path = path if path.endswith('/') else path + '/'
         self.name = self.path.split('/')[-2]
 
-        self.data = self.parse_module_file()
+        self.data = self.parse_module_file(data)
 
         self.description = self.data.get('description')
         self.version = self.data.get('version')
         self.autolaunch = self.get_autolaunch_mode()
         self.is_desktop = self.data.get('is_desktop', False)
+        # The launch script (or a child of it) calls `systemd-notify --ready` once the module is up.
+        self.launch_notify = self.data.get('launch_notify', False)
 
         self._system_services_validated = False
         self._module_services_validated = False
@@ -83,17 +125,18 @@ class PatchboxModule(object):
 
         self.errors = []
 
-    def parse_module_file(self):
+    def parse_module_file(self, data=None):
         path = os.path.join(self.path, self.__class__.PATCHBOX_MODULE_FILE)
         try:
-            with open(path) as f:
-                data = json.load(f)
-                module_keys = [k for k in data]
-                for k in self.__class__.PATCHBOX_MODULE_REQUIRED_KEYS:
-                    if k not in module_keys:
-                        raise ModuleError(
-                            '{}.module is not valid: "{}" key not defined in {}'.format(self.name, k, path))
-                return data
+            if data is None:
+                with open(path) as f:
+                    data = json.load(f)
+            module_keys = [k for k in data]
+            for k in self.__class__.PATCHBOX_MODULE_REQUIRED_KEYS:
+                if k not in module_keys:
+                    raise ModuleError(
+                        '{}.module is not valid: "{}" key not defined in {}'.format(self.name, k, path))
+            return data
         except (ValueError, IOError):
             raise ModuleError(
                 '{}.module file ({}) is not valid or missing'.format(self.name, path))
@@ -190,27 +233,10 @@ class PatchboxModule(object):
         raise ModuleError(
             '{}.module unsupported auto_launch mode: {}'.format(self.name, autolaunch))
 
-    def pre_install_validate(self, service_manager=PatchboxServiceManager()):
+    def pre_install_validate(self, service_manager=None):
         #todo: validation
         pass
 
-# Workaround to extract zips, keeping the permissions (especially +x).
-
-
-class ZipFileWithPermissions(zipfile.ZipFile):
-    def extract(self, member, path=None, pwd=None):
-        if not isinstance(member, zipfile.ZipInfo):
-            member = self.getinfo(member)
-
-        if path is None:
-            path = os.getcwd()
-
-        ret_val = self._extract_member(member, path, pwd)
-        attr = member.external_attr >> 16
-        if attr:
-            os.chmod(ret_val, attr)
-        return ret_val
-
 
 class PatchboxModuleManager(object):
 
@@ -218,29 +244,41 @@ class PatchboxModuleManager(object):
     PATCHBOX_MODULE_TMP_FOLDER = settings.PATCHBOX_MODULE_TMP_FOLDER
     PATCHBOX_MODULE_IGNORED = settings.PATCHBOX_MODULE_IGNORED
     PATCHBOX_MODULE_FILE = settings.PATCHBOX_MODULE_FILE
+    PATCHBOX_BOOT_PLAN = settings.PATCHBOX_BOOT_PLAN
+    BOOT_PLAN_VERSION = 2
     DEFAULT_SERVICE_MANAGER = PatchboxServiceManager
 
-    def __init__(self, path=None, service_manager=None):
-        self.path = self._verify_path(path)
+    def __init__(self, path=None, service_manager=None, read_only=False):
+        self.path = self._verify_path(path, read_only)
         self.imp_path = os.path.join(self.path, 'imported/')
         self.tmp_path = self.__class__.PATCHBOX_MODULE_TMP_FOLDER
-        if not os.path.isdir(self.tmp_path):
+        if not read_only and not os.path.isdir(self.tmp_path):
             os.makedirs(self.tmp_path)
-        self.state = PatchboxModuleStateManager()
+        self.state = PatchboxModuleStateManager(read_only=read_only)
         self._service_manager = service_manager or self.__class__.DEFAULT_SERVICE_MANAGER()
+        self._index = PatchboxModuleIndex([self.path, self.imp_path])
+        self._list_cache = PatchboxListCache()
         self._module_paths = None
+        # [(phase, seconds)] while timing an operation, None otherwise.
+        self.timings = None
 
-    def _verify_path(self, path):
+    def refresh(self):
+        """Picks up state and module changes made by other processes"""
+        self.state.refresh()
+        self._module_paths = None
+
+    def _verify_path(self, path, read_only=False):
         modules_path = path or self.__class__.PATCHBOX_MODULE_FOLDER
 
         if not os.path.isdir(modules_path):
-            if not path:
-                os.mkdir(modules_path)
-            else:
+            if path:
                 raise ModuleManagerError(
                     '"patchbox-modules" folder not found in "{}"'.format(path))
+            # Read only commands leave the folders to be created by the first one that writes, until then there are no modules.
+            if not read_only:
+                os.mkdir(modules_path)
 
-        if not os.path.isdir(os.path.join(modules_path, 'imported/')):
+        if not read_only and not os.path.isdir(os.path.join(modules_path, 'imported/')):
             os.mkdir(os.path.join(modules_path, 'imported/'))
 
         return modules_path
@@ -249,23 +287,10 @@ class PatchboxModuleManager(object):
         if self._module_paths:
             return self._module_paths
 
-        default = [(path.split('/')[-1], path) for path in glob.glob(self.path + '*') if os.path.isdir(
-            path)]
-
-        imported = [(path.split('/')[-1], path) for path in glob.glob(self.imp_path + '*') if os.path.isdir(
-            path)]
-        
-        paths = default + imported
+        # Only module folders and files changed since the index was written get looked at.
+        self._module_paths = self._index.get_paths()
 
-        modules = defaultdict(list)
-
-        for k, v in paths:
-            if k not in self.__class__.PATCHBOX_MODULE_IGNORED:
-                modules[k].append(v)
-        
-        self._module_paths = modules
-        
-        return modules
+        return self._module_paths
 
     def _pick_module_path_from_paths(self, module_name, paths, silent=False):
         path = None
@@ -279,8 +304,8 @@ class PatchboxModuleManager(object):
             version = None
             for can in paths:
                 try:
-                    tmp_module = PatchboxModule(can)
-                    if tmp_module.version >= version:
+                    tmp_module = PatchboxModule(can, self._index.get_data(can))
+                    if version is None or tmp_module.version >= version:
                         version = tmp_module.version
                         path = tmp_module.path
                 except Exception as err:
@@ -302,11 +327,12 @@ class PatchboxModuleManager(object):
         for name, paths in module_paths.items():
             path = self._pick_module_path_from_paths(name, paths, silent=True)
             try:
-                module = PatchboxModule(path)
+                module = PatchboxModule(path, self._index.get_data(path))
                 modules.append(module)
             except ModuleError as err:
                 pass
 
+        self._index.flush()
         return modules
 
     def get_module_by_name(self, module_name):
@@ -319,13 +345,105 @@ class PatchboxModuleManager(object):
         return self.get_module_by_path(path)
     
     def get_module_by_path(self, path):
-        module = PatchboxModule(path)
+        module = PatchboxModule(path, self._index.get_data(path))
+        self._index.flush()
         installed_version = self.state.get('version', module.path)
         if installed_version and installed_version != module.version:
             print('Manager: {}.module version mismatch {} vs {}'.format(module.name, installed_version, module.version))
             self.state.set('installed', False, module.path)
         return module
 
+    @contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.timings is not None:
+                self.timings.append((phase, time.perf_counter() - start))
+
+    def _get_module_file_stat(self, path):
+        try:
+            st = os.stat(os.path.join(path, self.__class__.PATCHBOX_MODULE_FILE))
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+    def _write_boot_plan(self, module, activation, launch):
+        """Saves what activating and launching the module came down to, for init to redo at the next boot
+
+        The plan holds the module's services, the actions configuring them and the
+        resolved launch command, so init neither reads the module nor validates the
+        launch argument again while the module and its state stay the same.
+        """
+        plan = {
+            'version': self.__class__.BOOT_PLAN_VERSION,
+            'path': module.path,
+            'stat': self._get_module_file_stat(module.path),
+            'module_version': module.version,
+            'name': module.name,
+            'is_desktop': module.is_desktop,
+            'auto_launch': self.state.get('auto_launch', module.path),
+            'activation': activation,
+            'launch': launch
+        }
+        path = self.__class__.PATCHBOX_BOOT_PLAN
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(plan, f)
+            os.replace(tmp_path, path)
+        except (IOError, OSError, TypeError, ValueError) as err:
+            print('Manager: failed to write boot plan: {}'.format(err))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_boot_plan(self):
+        try:
+            os.remove(self.__class__.PATCHBOX_BOOT_PLAN)
+        except OSError:
+            pass
+
+    def _load_boot_plan(self, module_path):
+        """Returns the boot plan of the module at module_path, None if there's none or it's out of date"""
+        try:
+            with open(self.__class__.PATCHBOX_BOOT_PLAN) as f:
+                plan = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if plan.get('version') != self.__class__.BOOT_PLAN_VERSION or plan.get('path') != module_path:
+            return None
+        if plan.get('stat') != self._get_module_file_stat(module_path):
+            return None
+        # Reinstalled, or given another launch argument since.
+        if not self.state.get('installed', module_path) or self.state.get('version', module_path) != plan.get('module_version'):
+            return None
+        if self.state.get('auto_launch', module_path) != plan.get('auto_launch'):
+            return None
+        return plan
+
+    def _run_boot_plan(self, plan):
+        """Does what activating and launching the module did when the plan was written"""
+        try:
+            services, system_services = self._run_activation(plan['activation'])
+        except (ServiceError, ModuleError) as error:
+            print('Manager: ERROR: {}'.format(error))
+            self._deactivate_module(self.get_module_by_path(plan['path']))
+            return
+        print('Manager: {}.module activated'.format(plan['name']))
+
+        with self._timed('service fixup'):
+            self._fixup_services(services, system_services)
+            self._service_manager.flush_restarts()
+        if not plan['launch']:
+            return
+        try:
+            with self._timed('launch'):
+                self._start_launch(plan['launch'])
+        except (ServiceError, ModuleError) as error:
+            print('Manager: ERROR: {}'.format(error))
+            self._stop_module(self.get_module_by_path(plan['path']))
+
     def get_active_module(self):
         module_path = self.get_active_module_path()
         if module_path:
@@ -338,13 +456,23 @@ class PatchboxModuleManager(object):
             return None
         return path
 
-    def init(self, is_user):
+    @manager_operation()
+    def init(self, is_user, timing=False):
         # init is triggered from both patchbox-init.service and patchbox-init.desktop - init the module in desktop mode only if user is set, via patchbox-init.desktop,
         # otherwise, init the module only if user is NOT set from patchbox-init.sevice context.
-        module = self.get_active_module()
-        if module and module.is_desktop == is_user:
+        self.timings = [] if timing else None
+        with self._timed('resolve active module'):
+            module_path = self.get_active_module_path()
+            plan = module_path and self._load_boot_plan(module_path)
+            module = None if plan else self.get_active_module()
+        if plan:
+            if plan['is_desktop'] == is_user:
+                print('Manager: {}.module loaded from boot plan'.format(plan['name']))
+                self._run_boot_plan(plan)
+        elif module and module.is_desktop == is_user:
             self.activate(module, autolaunch=True, autoinstall=False, update_env=False)
 
+    @manager_operation()
     def launch(self, module, arg=None):
         if not self.state.get('installed', module.path):
             self._install_module(module)
@@ -359,7 +487,7 @@ class PatchboxModuleManager(object):
             if active_path:
                 active = self.get_module_by_path(active_path)
                 self._stop_module(active)
-                self._deactivate_module(active)
+                self._deactivate_module(active, keep=self._plan_switch(active, module))
 
             try:
                 self._activate_module(module)
@@ -374,33 +502,46 @@ class PatchboxModuleManager(object):
             print('Manager: ERROR: {}'.format(error))
             self._stop_module(module)
 
-    def _fixup_service(self, module):
+    def _fixup_services(self, services, system_services):
         # Restart module's services if the modules they depend on got started later.
+        self._service_manager.add_dependencies(services, system_services)
 
         maximumTimestamp = 0
-        if module.get_system_services():
-            for service in module.get_system_services():
+        if system_services:
+            for service in system_services:
                 ts = self._service_manager.get_unit_start_timestamp(service)
                 maximumTimestamp = ts if ts > maximumTimestamp else maximumTimestamp
 
-        if module.get_module_services():
-            for service in module.get_module_services():
+        if services:
+            for service in services:
                 ts = self._service_manager.get_unit_start_timestamp(service)
                 if ts < maximumTimestamp:
                     print('Restarting service {} which got started before services it depends on'.format(service.name))
-                    self._service_manager.restart_unit(service)
+                    self._service_manager.restart_unit(service, reason='started before its dependencies')
 
     def _launch_module(self, module, arg=None):
-        self._fixup_service(module)
+        """Launches the module, returns the launch as _resolve_launch gave it, None without a launch script"""
+        with self._timed('service fixup'):
+            self._fixup_services(module.get_module_services(), module.get_system_services())
+            # The launch script must find the module's services already restarted.
+            self._service_manager.flush_restarts()
 
         if not module.has_launch:
-            return
+            return None
 
-        print('Manager: {}.module launch mode is {}'.format(
-            module.name, module.autolaunch))
+        with self._timed('launch'):
+            launch = self._resolve_launch(module, arg)
+            self._start_launch(launch)
+        return launch
+
+    def _resolve_launch(self, module, arg=None, verbose=True):
+        """Validates the launch argument, returns {name, path, argv, stop_argv, unit, notify} to _start_launch"""
+        if verbose:
+            print('Manager: {}.module launch mode is {}'.format(
+                module.name, module.autolaunch))
         arg = arg or self.state.get('auto_launch', module.path)
 
-        if arg:
+        if arg and verbose:
             print('Manager: {}.module launch argument is {}'.format(module.name, arg))
 
         if module.autolaunch in ['list', 'argument', 'path'] and not arg:
@@ -408,8 +549,7 @@ class PatchboxModuleManager(object):
                 '{}.module launch argument is missing'.format(module.name))
 
         if module.autolaunch == 'list':
-            options = self.list(module)
-            if arg not in options:
+            if not self._is_list_option(module, arg):
                 raise ModuleArgumentError(
                     '{}.module launch argument "{}" is not valid'.format(module.name, arg))
 
@@ -421,15 +561,62 @@ class PatchboxModuleManager(object):
         if module.autolaunch == 'auto':
             arg = None
 
+        return {
+            'name': module.name,
+            'path': module.path,
+            'argv': ['sh', os.path.join(module.path, module.has_launch)] + ([arg] if arg else []),
+            'stop_argv': ['sh', os.path.join(module.path, module.has_stop)] if module.has_stop else None,
+            # Desktop modules are launched from within the user's session, not by systemd.
+            'unit': None if module.is_desktop else self._get_launch_unit_name(module),
+            'notify': module.launch_notify
+        }
+
+    def _start_launch(self, launch):
+        name, path, argv = launch['name'], launch['path'], launch['argv']
+        # Lets the watcher restart the module again, see stop().
+        self.state.set('stopped', False, path)
+        unit = launch['unit']
+        # Only root can create units.
+        if unit and os.geteuid() == 0:
+            # Still running from an earlier launch.
+            self._service_manager.stop_transient_unit(unit)
+            launched = self._service_manager.start_transient_unit(
+                unit, argv, launch['stop_argv'], notify=launch['notify'], description='Patchbox {}.module'.format(name))
+            if launched:
+                result, duration = launched
+                # Recorded for status and stop, which may run without the privileges to tell on their own.
+                self.state.set('launch_unit', unit, path)
+                self.state.set('launch_pid', None, path)
+                if result != 'done':
+                    raise ModuleError(
+                        'failed to launch {}.module: {} {}'.format(name, unit, result))
+                self.state.set('launch_time_ms', int(duration * 1000.0), path)
+                print('Manager: {}.module launched as {}'.format(name, unit))
+                return
+
+        self.state.set('launch_unit', None, path)
         try:
-            if arg:
-                subprocess.Popen(['sh', os.path.join(module.path, module.has_launch), arg])
-            else:
-                subprocess.Popen(['sh', os.path.join(module.path, module.has_launch)])
+            # In a session of its own, which tells the processes of the launch apart without a unit.
+            process = subprocess.Popen(argv, start_new_session=True)
         except Exception as err:
             raise ModuleError(
-                'failed to launch {}.module {}'.format(module.name, err))
-        print('Manager: {}.module launched'.format(module.name))
+                'failed to launch {}.module {}'.format(name, err))
+        self.state.set('launch_pid', process.pid, path)
+        print('Manager: {}.module launched'.format(name))
+
+    @staticmethod
+    def _get_launch_unit_name(module):
+        return 'patchbox-module-{}.service'.format(re.sub(r'[^A-Za-z0-9_.-]', '_', module.name))
+
+    def _get_launch_unit(self, module):
+        """Returns the unit the module was last launched as, None if it was launched as a plain process"""
+        return self.state.get('launch_unit', module.path)
+
+    def _is_launched(self, module):
+        unit = self._get_launch_unit(module)
+        if not unit:
+            return False
+        return self._service_manager.get_units_status([unit], unit_files=False)[unit]['active_state'] in ['active', 'activating', 'reloading']
 
     def stop(self, is_user):
         active_path = self.get_active_module_path()
@@ -438,13 +625,33 @@ class PatchboxModuleManager(object):
 
         active = self.get_module_by_path(active_path)
 
-        if active.has_stop:
+        if active.has_stop or self._is_launched(active):
             self._stop_module(active, is_user)
+            # Stopped on purpose, not to be restarted by `module watch`.
+            self.state.set('stopped', True, active.path)
         else:
             raise ModuleManagerError(
                 '{}.module does not support stop command'.format(active.name))
 
+    @manager_operation()
+    def restart(self, module):
+        """Stops the active module, restarts its own services and launches it again"""
+        self._stop_module(module)
+        for service in module.get_module_services(fail_silent=True):
+            if service.auto_start:
+                # Folded into the start of the module's services by activate.
+                self._service_manager.restart_unit(service, reason='module restart')
+        self.activate(module, autolaunch=True, autoinstall=False, update_env=False)
+
     def _stop_module(self, module, is_user=False):
+        if self._get_launch_unit(module):
+            # Runs the stop script as the unit's ExecStop, then takes down whatever the launch left behind.
+            stopped = self._service_manager.stop_transient_unit(self._get_launch_unit(module))
+            if stopped:
+                result, duration = stopped
+                self.state.set('stop_time_ms', int(duration * 1000.0), module.path)
+                print('Manager: {}.module stopped'.format(module.name))
+                return
         if module.has_stop:
             try:
                 if not module.is_desktop or is_user:
@@ -458,22 +665,80 @@ class PatchboxModuleManager(object):
             print('Manager: {}.module stopped'.format(module.name))
         return
 
+    def iter_list(self, module):
+        """Yields the items printed by the module's list script as they come
+
+        The result is cached. Modules declaring "list_watch" paths get the cached
+        items back while it is valid, others have their script run every time.
+        """
+        if not module.has_list:
+            raise ModuleManagerError(
+                '{}.module does not support list command'.format(module.name))
+        if self._list_cache.get_watched_paths(module):
+            items = self._list_cache.get(module)
+            if items is not None:
+                yield from items
+                return
+
+        # Taken before the script runs, so changes made meanwhile invalidate the result.
+        key = self._list_cache.get_key(module)
+        items = []
+        try:
+            proc = subprocess.Popen(['sh', module.path + module.has_list], stdout=subprocess.PIPE)
+        except OSError:
+            raise ModuleError(
+                '{}.module listing error'.format(module.name))
+        try:
+            for line in proc.stdout:
+                item = line.decode('utf-8').rstrip('\n')
+                if item:
+                    items.append(item)
+                    yield item
+        except UnicodeDecodeError:
+            raise ModuleError(
+                '{}.module listing error'.format(module.name))
+        finally:
+            # Also reached when the caller stops early, closing the pipe ends the script.
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            raise ModuleError(
+                '{}.module listing error'.format(module.name))
+        self._list_cache.set(module, key, items)
+
     def list(self, module):
-        if module.has_list:
-            try:
-                output = subprocess.check_output(
-                    ['sh', module.path + module.has_list]).decode('utf-8')
-                return [item for item in output.rstrip().split('\n') if item]
-            except:
-                raise ModuleError(
-                    '{}.module listing error'.format(module.name))
-        raise ModuleManagerError(
-            '{}.module does not support list command'.format(module.name))
+        return list(self.iter_list(module))
+
+    def _is_list_option(self, module, arg):
+        # The saved list only counts while list_watch shows it is current, otherwise the script runs
+        # and stops as soon as the argument shows up.
+        return arg in self.iter_list(module)
+
+    ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar.zst', '.tzst', '.zip')
+    GIT_SCHEMES = ('git', 'ssh', 'git+ssh', 'ssh+git', 'file')
 
     @staticmethod
     def url_is_git(url):
+        # Answered without spawning git whenever the path or URL makes it obvious.
+        url = url.rpartition('#')[0] or url
+        if os.path.exists(url):
+            return os.path.isdir(os.path.join(url, '.git')) or \
+                (os.path.isfile(os.path.join(url, 'HEAD')) and os.path.isdir(os.path.join(url, 'objects')))
+        result = urllib.parse.urlparse(url)
+        if result.scheme in PatchboxModuleManager.GIT_SCHEMES:
+            return True
+        if not result.scheme and re.match(r'^[\w.-]+@[\w.-]+:', url):
+            # scp-like syntax, git@github.com:user/repo.git
+            return True
+        if result.scheme not in ['http', 'https']:
+            return False
+        if result.path.endswith('.git'):
+            return True
+        if result.path.lower().endswith(PatchboxModuleManager.ARCHIVE_EXTENSIONS):
+            return False
         try:
-            proc = subprocess.Popen(['git', 'ls-remote', url], stdout=DEVNULL, stderr=DEVNULL, env={"GIT_ASKPASS": "true"})
+            env = dict(os.environ, GIT_ASKPASS='true', GIT_TERMINAL_PROMPT='0')
+            proc = subprocess.Popen(['git', 'ls-remote', '--heads', url], stdout=DEVNULL, stderr=DEVNULL, env=env)
             return proc.wait() == 0
         except:
             return False
@@ -508,127 +773,327 @@ class PatchboxModuleManager(object):
             return PatchboxModuleManager.PathType.URL
         return PatchboxModuleManager.PathType.FILE
 
-    def install(self, path):
+    def _get_installed_sources(self):
+        sources = {}
+        for path, module_state in self.state.get('modules').items():
+            if module_state.get('source') and module_state.get('installed') and os.path.isdir(path):
+                sources[module_state.get('source')] = path
+        return sources
+
+    def _prepare_install(self, install, installed_sources):
+        """Fetches and extracts a source into its own staging folder
+
+        Runs in a worker thread during batch installs, so it leaves the state alone.
+        """
+        # Only needed for installing, kept out of the import path of every other command.
+        import tempfile
+        from patchbox.archive import extract_archive, extract_tar_stream, ArchiveError
+        from patchbox.git_cache import PatchboxGitCache, GitError, split_ref
+        from patchbox.download import PatchboxDownload, DownloadError, verify_file, file_digest
+
+        path = install.path
         pathType = PatchboxModuleManager.path_get_type(path)
 
-        tmp_dir = self.tmp_path
-        module_name = None
-
+        file = None
         if pathType == PatchboxModuleManager.PathType.GIT:
-            module_name = PatchboxModuleManager.url_git_get_name(path)
-            subprocess.call(['git', 'clone', path, module_name], cwd=self.tmp_path)
-        elif pathType in [PatchboxModuleManager.PathType.URL, PatchboxModuleManager.PathType.FILE]:
-            file = None
-            if pathType == PatchboxModuleManager.PathType.URL:
-                r = requests.get(path)
-                if r.status_code == 200:
+            url, ref = split_ref(path)
+            if os.path.exists(url):
+                # One cache entry for both spellings of a local repository.
+                url = 'file://' + os.path.abspath(url)
+            module_name = PatchboxModuleManager.url_git_get_name(url)
+            git_cache = PatchboxGitCache()
+            try:
+                commit = git_cache.fetch(url, ref)
+            except GitError as err:
+                raise ModuleManagerError('{} fetch failed: {}'.format(path, err))
+            install.source = 'git:' + commit
+        else:
+            try:
+                if pathType == PatchboxModuleManager.PathType.URL:
+                    # Streamed to disk, large modules don't have to fit in memory.
                     file = tempfile.NamedTemporaryFile()
-                    file.write(r.content)
-                    file.flush()
+                    digest = PatchboxDownload(path, file, checksum=install.checksum).run()
                     path = file.name
                 else:
-                    raise ModuleManagerError('{} returned status code {}'.format(path, r.status_code))
-            else:
-                if not os.path.exists(path):
-                    raise ModuleManagerError('{} does not exist'.format(path))
-
-            tar_file_path = None
-            zip_file_path = None
-
-            if os.path.isdir(path):
-                raise ModuleManagerError(
-                    'module file can\'t be a directory: {}'.format(path))
-
-            if tarfile.is_tarfile(path):
-                tar_file_path = path
+                    if not os.path.exists(path):
+                        raise ModuleManagerError('{} does not exist'.format(path))
+                    if os.path.isdir(path):
+                        raise ModuleManagerError(
+                            'module file can\'t be a directory: {}'.format(path))
+                    digest = verify_file(path, install.checksum) if install.checksum else file_digest(path)
+            except DownloadError as err:
+                raise ModuleManagerError(str(err))
+            install.source = 'sha256:' + digest
+
+        installed_path = installed_sources.get(install.source)
+        if installed_path:
+            print('Manager: {} is already installed from the same source ({}), skipping'.format(installed_path, install.source))
+            install.status = 'skipped'
+            return
 
-            if zipfile.is_zipfile(path):
-                zip_file_path = path
+        # Staged next to its final location, so publishing it is a rename on the same filesystem.
+        staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=self.imp_path)
+        install.staging_dir = staging_dir
 
-            if not tar_file_path and not zip_file_path:
-                raise ModuleManagerError(
-                    '{} is not a valid file type: *.tar and *.zip files are supported'.format(path))
-
-            print('Manager: extracting {} to {}'.format(path, tmp_dir))
-            try:
-                if tar_file_path:
-                    tar_file = tarfile.open(tar_file_path)
-                    tar_file.extractall(path=tmp_dir)
-                    tar_file.close()
-
-                if zip_file_path:
-                    zip_file = ZipFileWithPermissions(zip_file_path, 'r')
-                    zip_file.extractall(tmp_dir)
-                    zip_file.close()
-
-                files = glob.glob(tmp_dir + '*')
-            
-                if len(files) > 1 or not os.path.isdir(files[0]):
-                    raise Exception
-
-                module_name = files[0].split('/')[-1]
-                print('Manager: {}.module found'.format(module_name))
-            except:
-                raise ModuleManagerError(
-                    '{} module extraction failed'.format(path), remove_dir=tmp_dir)
-
-        module = self.get_module_by_path(os.path.join(tmp_dir, module_name))
+        print('Manager: extracting {} to {}'.format(path, staging_dir))
+        try:
+            # Files unchanged since the installed version are hard linked from it instead of written again.
+            if pathType == PatchboxModuleManager.PathType.GIT:
+                process = git_cache.archive(url, commit, module_name + '/')
+                try:
+                    extracted = extract_tar_stream(process.stdout, staging_dir, reuse_dir=self.imp_path)
+                finally:
+                    process.stdout.close()
+                    if process.wait() != 0:
+                        raise ArchiveError('git archive failed with exit code {}'.format(process.returncode))
+            else:
+                extracted = extract_archive(path, staging_dir, reuse_dir=self.imp_path)
+        except ArchiveError as err:
+            raise ModuleManagerError(str(err), remove_dir=staging_dir)
+        except Exception:
+            raise ModuleManagerError(
+                '{} module extraction failed'.format(path), remove_dir=staging_dir)
+        finally:
+            if file:
+                file.close()
+        install.content_hash = extracted.hash
+        if extracted.linked:
+            print('Manager: {} of {} files unchanged ({} bytes), hard linked from the installed version'.format(
+                extracted.linked, extracted.files, extracted.linked_bytes))
+
+        files = os.listdir(staging_dir)
+        if len(files) != 1 or not os.path.isdir(os.path.join(staging_dir, files[0])):
+            raise ModuleManagerError(
+                '{} module extraction failed: expected a single module folder'.format(path), remove_dir=staging_dir)
+        module_name = files[0]
+        print('Manager: {}.module found'.format(module_name))
 
-        if not isinstance(module, PatchboxModule):
-            raise ModuleManagerError('{} is not a valid module'.format(
-                str(module)), remove_dir=tmp_dir)
+        module = PatchboxModule(os.path.join(staging_dir, module_name))
 
         if not module.is_valid():
             raise ModuleManagerError(
-                "{}.module is not valid: {}".format(module.name, module.errors), remove_dir=tmp_dir)
+                "{}.module is not valid: {}".format(module.name, module.errors), remove_dir=staging_dir)
         print('Manager: {}.module is valid'.format(module.name))
+        install.module = module
 
-        if os.path.isdir(os.path.join(self.imp_path, module_name)):
-            rmtree(os.path.join(self.imp_path, module_name))
-            print('Manager: old {}.module deleted'.format(module.name))
-
-        try:
-            copytree(os.path.join(tmp_dir, module_name),
-                     os.path.join(self.imp_path, module_name))
-        except (shutil_error, OSError) as e:
-            raise ModuleManagerError(
-                "{}.module copy failed".format(module.name), remove_dir=tmp_dir)
-        print('Manager: {}.module prepared for installation'.format(module.name))
-        
+    @manager_operation()
+    def _publish_install(self, install, force=False):
+        """Moves a prepared module from its staging folder into imported/"""
+        module_name = install.module.name
+        staging_dir = install.staging_dir
         new_path = os.path.join(self.imp_path, module_name)
-        new_path = new_path if new_path.endswith('/') else new_path + '/'
-        module.path = new_path
+        if not force and os.path.isdir(new_path) and self.state.get('installed', new_path + '/') and \
+                self.state.get('hash', new_path + '/') == install.content_hash:
+            rmtree(staging_dir)
+            self.state.set('source', install.source, new_path + '/')
+            print('Manager: {}.module content unchanged ({}), skipping installation'.format(module_name, install.content_hash))
+            install.status = 'unchanged'
+            return
 
+        old_path = os.path.join(staging_dir, '.old')
         try:
-            self._install_module(module)
-        except ModuleError as err:
+            # Swapped in with two renames, the old version ends up in the staging folder and goes with it.
+            if os.path.isdir(new_path):
+                os.rename(new_path, old_path)
+            os.rename(os.path.join(staging_dir, module_name), new_path)
+        except OSError:
+            if os.path.isdir(old_path) and not os.path.exists(new_path):
+                os.rename(old_path, new_path)
             raise ModuleManagerError(
-                "{}.module installation failed".format(module.name), remove_dir=os.path.join(self.imp_path, module_name))
+                "{}.module copy failed".format(module_name), remove_dir=staging_dir)
+        if os.path.isdir(old_path):
+            print('Manager: old {}.module deleted'.format(module_name))
+        rmtree(staging_dir)
+        print('Manager: {}.module prepared for installation'.format(module_name))
 
-        self._deactivate_module(module, fake=True)
+        install.module = self.get_module_by_path(new_path + '/')
 
-        rmtree(tmp_dir)
-
-    def _install_module(self, module):
-        if module.has_install:
-            print('Manager: {}.module install script found: {}'.format(module.name, os.path.join(module.path, module.has_install)))
+    @staticmethod
+    def _get_install_dependencies(installs):
+        """Returns {install: [installs providing services it depends on]} within the batch"""
+        get_unit_name = PatchboxServiceManager._get_unit_name
+        providers = {}
+        for install in installs:
+            for service in install.module.get_module_services(fail_silent=True):
+                providers.setdefault(get_unit_name(service.name), []).append(install)
+        dependencies = {}
+        for install in installs:
+            dependencies[install] = []
+            for service in install.module.get_system_services(fail_silent=True):
+                for provider in providers.get(get_unit_name(service.name), []):
+                    if provider is not install and provider not in dependencies[install]:
+                        dependencies[install].append(provider)
+        return dependencies
+
+    @manager_operation()
+    def _finish_install(self, install):
+        module = install.module
+        self._set_installed(module)
+        # Recorded only once the install script succeeded, a failed install is retried in full.
+        self.state.set('hash', install.content_hash, module.path)
+        self.state.set('source', install.source, module.path)
+        self._deactivate_module(module, fake=True)
+        install.status = 'installed'
+
+    def _run_install_scripts(self, installs, jobs):
+        """Runs the install scripts of published modules, at most jobs at a time
+
+        A module whose depends_on names a service of another module in the batch waits
+        for that module's install to finish first.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        dependencies = self._get_install_dependencies(installs)
+        pending = list(installs)
+        running = {}
+        # Output of scripts running side by side is collected and printed in one piece.
+        capture = jobs > 1 and len(installs) > 1
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for install in list(pending):
+                    failed = [dependency for dependency in dependencies[install] if dependency.status == 'failed']
+                    if failed:
+                        install.fail('depends on {}.module, which failed to install'.format(failed[0].name))
+                        pending.remove(install)
+                    elif len(running) < jobs and all(dependency.status == 'installed' for dependency in dependencies[install]):
+                        pending.remove(install)
+                        running[pool.submit(self._run_install_script, install.module, capture)] = (install, time.perf_counter())
+                if not running:
+                    for install in pending:
+                        install.fail('circular dependency between the modules being installed')
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    install, start = running.pop(future)
+                    install.timings['install'] = time.perf_counter() - start
+                    try:
+                        install.output = future.result()
+                    except ModuleError as err:
+                        install.output = getattr(err, 'output', None)
+                        install.fail(err)
+                    if install.output:
+                        print('Manager: {}.module install script output:\n{}'.format(install.name, install.output.rstrip()))
+                    if install.status == 'failed':
+                        rmtree(install.module.path, ignore_errors=True)
+                        print('Manager: {} directory deleted'.format(install.module.path))
+                    else:
+                        self._finish_install(install)
+
+    def install_many(self, installs, jobs=None, script_jobs=None, force=False):
+        """Installs a batch of PatchboxModuleInstall, a failing source doesn't stop the others
+
+        Sources are fetched and extracted by up to jobs workers, install scripts are run
+        by up to script_jobs. Modules already installed from the same source or with the
+        same content are skipped unless force is set. Returns the installs, with their
+        status and timings.
+
+        Not a manager operation as a whole: downloads and install scripts run without
+        one, each publish and each finished install is recorded in its own.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        jobs = jobs or settings.PATCHBOX_INSTALL_JOBS
+        script_jobs = script_jobs or settings.PATCHBOX_INSTALL_SCRIPT_JOBS
+        if not os.path.isdir(self.imp_path):
+            os.makedirs(self.imp_path)
+        self.refresh()
+        installed_sources = {} if force else self._get_installed_sources()
+
+        def prepare(install):
+            start = time.perf_counter()
             try:
-                subprocess.call(
-                    ['chmod', '+x', os.path.join(module.path, module.has_install)])
-                error = subprocess.call(
-                    ['sh', '-e', os.path.join(module.path, module.has_install)])
-                if error != 0:
-                    raise ModuleError(
-                        'Failed to install {}.module via {} script'.format(module.name, os.path.join(module.path, module.has_install)))
-            except:
-                raise ModuleError(
-                    'Failed to install {}.module via {} script'.format(module.name, os.path.join(module.path, module.has_install)))
-        else:
+                self._prepare_install(install, installed_sources)
+            except ModuleManagerError as err:
+                install.fail(err)
+            except Exception as err:
+                install.fail('{} install failed: {}'.format(install.path, err))
+                if install.staging_dir:
+                    rmtree(install.staging_dir, ignore_errors=True)
+            install.timings['fetch'] = time.perf_counter() - start
+            return install
+
+        # The same source given twice is fetched once, the later entries fail right away.
+        paths = {}
+        for install in installs:
+            if install.path in paths:
+                install.fail('{} is already in this install batch'.format(install.path))
+            else:
+                paths[install.path] = install
+        pending = [install for install in installs if install.status == 'pending']
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+                list(pool.map(prepare, pending))
+
+        # Published only once every fetch is done: an extraction still running could be hard linking
+        # from the very folder a publish swaps out. Of several sources of one module, the first wins.
+        published = []
+        names = {}
+        for install in installs:
+            if install.status != 'pending':
+                continue
+            if install.module.name in names:
+                install.fail('{}.module is also installed from {}'.format(install.module.name, names[install.module.name].path))
+                rmtree(install.staging_dir, ignore_errors=True)
+                continue
+            names[install.module.name] = install
+            try:
+                self._publish_install(install, force)
+            except ModuleManagerError as err:
+                install.fail(err)
+                continue
+            if install.status == 'pending':
+                published.append(install)
+
+        if published:
+            self._run_install_scripts(published, script_jobs)
+        return installs
+
+    def install(self, path, checksum=None, force=False):
+        install = self.install_many([PatchboxModuleInstall(path, checksum)], jobs=1, script_jobs=1, force=force)[0]
+        if install.status == 'failed':
+            raise ModuleManagerError(install.error)
+
+    @staticmethod
+    def print_install_report(installs):
+        for install in installs:
+            print('Install: {:<24} {:<9} fetch {:6.1f} s  install {:6.1f} s{}'.format(
+                install.name, install.status, install.timings.get('fetch', 0.0), install.timings.get('install', 0.0),
+                '  ' + install.error if install.error else ''))
+
+    def _run_install_script(self, module, capture=False):
+        """Runs the module's install script, returns its output when captured"""
+        if not module.has_install:
             print('Manager: no install script declared for {}.module'.format(module.name))
+            return None
+        script = os.path.join(module.path, module.has_install)
+        print('Manager: {}.module install script found: {}'.format(module.name, script))
+        error = 'Failed to install {}.module via {} script'.format(module.name, script)
+        try:
+            subprocess.call(['chmod', '+x', script])
+            if capture:
+                proc = subprocess.run(['sh', '-e', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                      universal_newlines=True)
+                returncode, output = proc.returncode, proc.stdout
+            else:
+                returncode, output = subprocess.call(['sh', '-e', script]), None
+        except OSError:
+            raise ModuleError(error)
+        if returncode != 0:
+            err = ModuleError(error)
+            err.output = output
+            raise err
+        return output
+
+    def _set_installed(self, module):
         self.state.set('installed', True, module.path)
         self.state.set('version', module.version, module.path)
         print('Module name: {}'.format(module.name))
 
+    def _install_module(self, module):
+        self._run_install_script(module)
+        self._set_installed(module)
+
+    @manager_operation()
     def activate(self, module, autolaunch=True, autoinstall=False, update_env=True, is_user=False):
         if not self.state.get('installed', module.path):
             if not autoinstall:
@@ -640,60 +1105,135 @@ class PatchboxModuleManager(object):
         if active_path and active_path != module.path:
             active = self.get_module_by_path(active_path)
             self._stop_module(active)
-            self._deactivate_module(active)
+            self._deactivate_module(active, keep=self._plan_switch(active, module))
 
         try:
-            self._activate_module(module, update_env)
+            activation = self._activate_module(module, update_env)
         except (ServiceError, ModuleError) as error:
             print('Manager: ERROR: {}'.format(error))
             self._deactivate_module(module)
             return
 
+        launch = None
         if module.autolaunch and autolaunch:
             try:
-                self._launch_module(module, is_user)
+                launch = self._launch_module(module)
             except (ServiceError, ModuleError, ModuleArgumentError) as error:
                 print('Manager: ERROR: {}'.format(error))
                 self._stop_module(module)
+        elif module.autolaunch and module.has_launch:
+            try:
+                launch = self._resolve_launch(module, verbose=False)
+            except ModuleArgumentError:
+                pass
 
-    def _activate_module(self, module, update_env):
-        if module.get_system_services():
-            for service in module.get_system_services():
-                self._service_manager.enable_start_unit(service)
-
-        if module.get_module_services():
-            for service in module.get_module_services():
-                if service.auto_start:
-                    self._service_manager.enable_start_unit(service)
-                else:
-                    print('Manager: {} auto_start {}'.format(
-                        service.name, service.auto_start))
-
+        # init always launches, a plan without the launch it would need is no use.
+        if launch or not (module.autolaunch and module.has_launch):
+            self._write_boot_plan(module, activation, launch)
+        else:
+            self._remove_boot_plan()
+
+    def _activate_module(self, module, update_env=True):
+        """Activates the module, returns the activation as _run_activation takes it"""
+        activation = {
+            'system_services': [service.get_declaration() for service in module.get_system_services()],
+            'services': [service.get_declaration() for service in module.get_module_services()],
+            'actions': self._service_manager.get_configure_actions(
+                module.get_system_services() + [service for service in module.get_module_services() if service.auto_start]),
+            'health': bool(module.data.get('health'))
+        }
+        # All environment changes of the activation go into /etc/environment with one rewrite, before any service starts.
+        if update_env:
+            penviron.set('PATCHBOX_MODULE_ACTIVE', module.path)
+        self._run_activation(activation)
         if update_env:
             self.state.set_active_module(module.path)
         print('Manager: {}.module activated'.format(module.name))
+        return activation
+
+    def _run_activation(self, activation):
+        """Configures and starts the services of an activation, returns (module services, system services)"""
+        system_services = [PatchboxService(service) for service in activation['system_services']]
+        module_services = [PatchboxService(service) for service in activation['services']]
+        # System services are started as one batch ahead of the module's own services, which depend on them.
+        self._service_manager.add_dependencies(module_services, system_services)
+        services = []
+        for service in module_services:
+            if service.auto_start:
+                services.append(service)
+            else:
+                print('Manager: {} auto_start {}'.format(
+                    service.name, service.auto_start))
+
+        with self._timed('configure services'):
+            configured = self._service_manager.apply_configure_actions(activation['actions'])
+
+        if system_services:
+            with self._timed('system services'):
+                self._service_manager.enable_start_units(system_services, configured=configured)
 
+        if services:
+            with self._timed('module services'):
+                self._service_manager.enable_start_units(services, configured=configured)
+
+        self._update_watch(activation['health'])
+        return module_services, system_services
+
+    def _update_watch(self, health):
+        """Starts patchbox-watch.service if the active module has a "health" section, stops it otherwise"""
+        watch = PatchboxService(settings.PATCHBOX_WATCH_SERVICE)
+        unit = self._service_manager.get_units_status([watch.name], unit_files=False)[watch.name]
+        if unit['load_state'] != 'loaded':
+            # Not installed, e.g. when running from a source checkout.
+            return
+        running = unit['active_state'] in ['active', 'activating', 'reloading']
+        if health:
+            if not running:
+                self._service_manager.start_unit(watch)
+        elif running:
+            self._service_manager.stop_unit(watch)
+
+    @manager_operation()
     def deactivate(self):
         active_path = self.get_active_module_path()
         if active_path:
             active = self.get_module_by_path(active_path)
             self._stop_module(active)
             self._deactivate_module(active)
+            self._update_watch(False)
 
-    def _deactivate_module(self, module, fake=False):
+    def _plan_switch(self, active, module):
+        """Returns {name: reset} for the services of the active module which the incoming module keeps running"""
+        try:
+            incoming = dict((service.name, service) for service in module.get_system_services())
+            incoming.update((service.name, service) for service in module.get_module_services() if service.auto_start)
+        except (ModuleError, ServiceError):
+            return {}
+        keep = {}
+        for service in active.get_system_services(fail_silent=True) + active.get_module_services(fail_silent=True):
+            if service.name in incoming:
+                # Activation applies the incoming configuration, only a configuration without replacement needs a reset.
+                keep[service.name] = bool(service.environ_value and not incoming[service.name].environ_value)
+                print('Manager: {} is shared with {}.module, keeping it running'.format(service.name, module.name))
+        return keep
+
+    def _deactivate_module(self, module, fake=False, keep=None):
+        keep = keep or {}
         if module.get_module_services(fail_silent=True):
-            for service in module.get_module_services():
-                self._service_manager.stop_disable_unit(service)
+            self._service_manager.stop_disable_units([service for service in module.get_module_services() if service.name not in keep])
         if not fake:
             if module.get_system_services(fail_silent=True):
                 for service in module.get_system_services():
-                    self._service_manager.reset_unit_environment(service)
+                    if keep.get(service.name, True):
+                        self._service_manager.reset_unit_environment(service)
             self.state.set_active_module(None)
+            self._remove_boot_plan()
             print('Manager: {}.module deactivated'.format(module.name))
 
     def _set_autolaunch_argument(self, module, arg):
         self.state.set('auto_launch', arg, module.path)
 
+    @manager_operation(transaction=False)
     def status(self):
         status = ''
         status += 'module_active={}\n'.format(self.state.get('active_module'))
@@ -702,8 +1242,26 @@ class PatchboxModuleManager(object):
             status += 'module_version={}\n'.format(module.version)
             status += 'module_auto_launch_mode={}\n'.format(module.autolaunch)
             status += 'module_auto_launch_argument={}\n'.format(self.state.get('auto_launch', module.path))
-            for service in module.get_system_services():
-                status += 'module_system_service_{}={}\n'.format(service.name.split('.')[0], self._service_manager.get_active_state(service))
-            for service in module.get_module_services():
-                status += 'module_service_{}={}\n'.format(service.name.split('.')[0], self._service_manager.get_active_state(service))
+            system_services = module.get_system_services()
+            module_services = module.get_module_services()
+            names = [service.name for service in system_services + module_services]
+            launch_unit = module.has_launch and self._get_launch_unit(module)
+            if launch_unit:
+                names.append(launch_unit)
+            units = self._service_manager.get_units_status(names, unit_files=False)
+            if launch_unit:
+                status += 'module_launch_state={}\n'.format(units[launch_unit]['active_state'])
+                status += 'module_launch_time_ms={}\n'.format(self.state.get('launch_time_ms', module.path))
+                status += 'module_stop_time_ms={}\n'.format(self.state.get('stop_time_ms', module.path))
+            if module.data.get('health'):
+                status += 'module_health={}\n'.format(self.state.get('health', module.path))
+                status += 'module_crash_count={}\n'.format(self.state.get('crash_count', module.path) or 0)
+                crash_time = self.state.get('last_crash_time', module.path)
+                status += 'module_last_crash_time={}\n'.format(
+                    time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(crash_time)) if crash_time else None)
+                status += 'module_last_crash_reason={}\n'.format(self.state.get('last_crash_reason', module.path))
+            for service in system_services:
+                status += 'module_system_service_{}={}\n'.format(service.name.split('.')[0], units[service.name]['active_state'])
+            for service in module_services:
+                status += 'module_service_{}={}\n'.format(service.name.split('.')[0], units[service.name]['active_state'])
         return status.rstrip()
@@ -0,0 +1,112 @@
+import copy
+import hashlib
+import json
+import os
+from collections import defaultdict
+from patchbox import settings
+
+
+class PatchboxModuleIndex(object):
+    """Cached listing of the module folders and their parsed patchbox-module.json files"""
+
+    VERSION = 1
+
+    def __init__(self, roots, path=None):
+        self.roots = roots
+        self.path = path or settings.PATCHBOX_MODULE_INDEX
+        self.module_file = settings.PATCHBOX_MODULE_FILE
+        self.ignored = settings.PATCHBOX_MODULE_IGNORED
+        self._data = None
+        self._changed = False
+        # Number of module files parsed by this process, the index is doing its job when it stays at 0.
+        self.parsed = 0
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                with open(self.path, 'rt') as f:
+                    self._data = json.load(f)
+            except (IOError, ValueError):
+                self._data = None
+            if not self._data or self._data.get('version') != self.__class__.VERSION:
+                self._data = {'version': self.__class__.VERSION, 'roots': {}, 'modules': {}}
+        return self._data
+
+    def flush(self):
+        """Writes the index if anything was revalidated since it was read"""
+        if not self._changed:
+            return
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wt') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            # Unprivileged processes can't write the index, they still benefit from a valid one.
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        self._changed = False
+
+    def _list_root(self, root):
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.data['roots'].get(root)
+        if cached and cached['mtime'] == mtime:
+            return cached['entries']
+        # Dot folders are installs being staged in imported/.
+        entries = sorted(entry.name for entry in os.scandir(root)
+                         if entry.is_dir() and entry.name not in self.ignored and not entry.name.startswith('.'))
+        self.data['roots'][root] = {'mtime': mtime, 'entries': entries}
+        self._changed = True
+        return entries
+
+    def _validate(self, path):
+        try:
+            st = os.stat(os.path.join(path, self.module_file))
+            key = [st.st_mtime_ns, st.st_size, st.st_ino]
+        except OSError:
+            key = None
+        cached = self.data['modules'].get(path)
+        if cached and cached['stat'] == key:
+            return cached
+
+        entry = {'stat': key, 'hash': None, 'data': None}
+        if key is not None:
+            try:
+                with open(os.path.join(path, self.module_file), 'rb') as f:
+                    content = f.read()
+                entry['hash'] = hashlib.sha1(content).hexdigest()
+                if cached and cached['hash'] == entry['hash']:
+                    # Touched, but not changed.
+                    entry['data'] = cached['data']
+                else:
+                    self.parsed += 1
+                    entry['data'] = json.loads(content.decode('utf-8'))
+            except (IOError, ValueError):
+                entry['data'] = None
+        self.data['modules'][path] = entry
+        self._changed = True
+        return entry
+
+    def get_paths(self):
+        """Returns {name: [paths]} of the module folders, module files are only validated once asked for"""
+        paths = defaultdict(list)
+        for root in self.roots:
+            for name in self._list_root(root):
+                paths[name].append(os.path.join(root, name))
+
+        seen = set(path for name in paths for path in paths[name])
+        for path in [path for path in self.data['modules'] if path not in seen]:
+            del self.data['modules'][path]
+            self._changed = True
+        return paths
+
+    def get_data(self, path):
+        """Returns a copy of the parsed module file of the module at path, None if it's missing or invalid"""
+        entry = self._validate(path.rstrip('/'))
+        return copy.deepcopy(entry['data'])
@@ -3,11 +3,7 @@ import glob
 import subprocess
 import re
 import click
-from patchbox.utils import do_group_menu, do_go_back_if_ineractive
-
-
-def get_system_service_property(name, prop):
-    return subprocess.check_output(['systemctl', 'show', '-p', prop, '--value', name]).strip().decode('utf-8')
+from patchbox.utils import do_group_menu, do_go_back_if_ineractive, get_system_services_status, read_only
 
 
 def get_devices():
@@ -43,11 +39,12 @@ def get_rfkill_bluetooth_status():
 
 def get_status():
     services = ['bluetooth', 'bluealsa', 'hciuart']
-    properties = {'active_state': 'ActiveState', 'sub_state': 'SubState'}
+    properties = ['active_state', 'sub_state']
     results = 'bluetooth_supported={}\n'.format(int(is_supported()))
+    units = get_system_services_status(services)
     for service in services:
         for prop in properties:
-            value = get_system_service_property(service, properties.get(prop)) or 'unknown'
+            value = units[service].get(prop) or 'unknown'
             results += '{}_service_{}={}\n'.format(service, prop, value)
     results += get_rfkill_bluetooth_status()
     return results
@@ -61,6 +58,7 @@ def cli(ctx):
 
 
 @cli.command()
+@read_only
 def status():
     """Display Bluetooth status"""
     click.echo(get_status().strip())
@@ -3,7 +3,7 @@ import click
 import os
 from os.path import isfile, join, expanduser
 from patchbox import settings
-from patchbox.utils import do_group_menu, do_ensure_param, do_go_back_if_ineractive
+from patchbox.utils import do_group_menu, do_ensure_param, do_go_back_if_ineractive, read_only
 from patchbox.environment import PatchboxEnvironment as penviron
 
 
@@ -154,6 +154,7 @@ def cli(ctx):
 
 @cli.command()
 @click.pass_context
+@read_only
 def interactions(ctx):
     """List all supported Button interactions"""
     if not ctx.obj.is_supported():
@@ -175,6 +176,7 @@ def status(ctx):
 
 @cli.command()
 @click.pass_context
+@read_only
 def actions(ctx):
     """List all supported Button actions"""
     if not ctx.obj.is_supported():
@@ -1,6 +1,6 @@
 import click
 import subprocess
-from patchbox.utils import do_go_back_if_ineractive
+from patchbox.utils import do_go_back_if_ineractive, read_only
 
 
 def is_pisound():
@@ -67,6 +67,7 @@ def get_hostname():
 
 
 @click.command()
+@read_only
 def cli():
     """Display System info"""
     message = 'IP Address: {}'\
@@ -3,7 +3,7 @@ import shlex
 import click
 import os
 import time
-from patchbox.utils import do_group_menu, do_ensure_param, do_go_back_if_ineractive, get_system_service_property
+from patchbox.utils import do_group_menu, do_ensure_param, do_go_back_if_ineractive, get_system_services_status, read_only
 
 
 def get_cards():
@@ -40,7 +40,7 @@ def jack_verify():
         click.echo('Waiting for Jack to boot...', err=True)
         ec = subprocess.call(['jack_wait','-w','-t','10'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         if ec == 0:
-            state = get_system_service_property('jack', 'SubState')
+            state = get_system_services_status(['jack'])['jack']['sub_state']
             if state == 'running':
                 click.echo('Jack is running!', err=True)
         else:
@@ -114,10 +114,11 @@ def update_jack_config(param, value):
 
 
 def get_status():
-    properties = {'active_state': 'ActiveState', 'sub_state': 'SubState'}
+    properties = ['active_state', 'sub_state']
     results = 'jack_installed={}\n'.format(int(jack_installed()))
+    unit = get_system_services_status(['jack'])['jack']
     for prop in properties:
-        value = get_system_service_property('jack', properties.get(prop)) or 'unknown'
+        value = unit.get(prop) or 'unknown'
         results += '{}_service_{}={}\n'.format('jack', prop, value)
     return results.rstrip()
 
@@ -151,6 +152,7 @@ def restart():
 
 
 @cli.command()
+@read_only
 def status():
     """Display Jack service status"""
     click.echo(get_status())
@@ -7,8 +7,7 @@ import time
 import struct
 import json
 from patchbox import settings
-from patchbox.utils import run_cmd, do_group_menu, do_ensure_param, do_go_back_if_ineractive, run_interactive_cmd, go_home_or_exit, do_pause_if_interactive
-from patchbox.views import do_yesno
+from patchbox.utils import run_cmd, do_group_menu, do_ensure_param, do_go_back_if_ineractive, run_interactive_cmd, go_home_or_exit, do_pause_if_interactive, do_yesno
 
 def get_kernel_name():
 	return subprocess.check_output(['uname', '-a']).decode('utf-8')
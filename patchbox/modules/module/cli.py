@@ -2,12 +2,25 @@ import os
 import click
 import json
 import subprocess
+import time
 from patchbox.utils import do_group_menu, do_ensure_param, do_go_back_if_ineractive, get_system_service_property
-from patchbox.module import PatchboxModuleManager, ModuleNotFound, ModuleNotInstalled, ModuleError, ModuleManagerError
-from patchbox.views import do_msgbox, do_yesno, do_menu, do_inputbox
-from patchbox.utils import do_go_back_if_ineractive, run_interactive_cmd
+from patchbox.module import PatchboxModuleManager, PatchboxModuleInstall, ModuleNotFound, ModuleNotInstalled, ModuleError, ModuleManagerError
+from patchbox.utils import do_msgbox, do_yesno, do_menu, do_inputbox
+from patchbox.utils import do_go_back_if_ineractive, run_interactive_cmd, read_only, InteractiveFallback
 from patchbox.service import PatchboxService
 
+def get_process_age():
+    # Seconds since this process was started, at the kernel's clock tick resolution.
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
 def start_or_restart_module(manager, module):
     if module.is_desktop:
         subprocess.call([os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts/patchbox_init_as_user.sh')])
@@ -27,36 +40,49 @@ def get_module_by_name(ctx, name, silent=False):
 @click.pass_context
 def cli(ctx):
     """Manage Patchbox modules"""
-    ctx.obj = PatchboxModuleManager()
+    ctx.obj = ctx.meta.get('module_manager') or PatchboxModuleManager(read_only=ctx.meta.get('read_only', False))
+    ctx.obj._service_manager.verbose = ctx.meta.get('verbose', False)
     if ctx.invoked_subcommand is None:
         if ctx.meta.get('interactive'):
             ctx.invoke(ctx.command.get_command(ctx, 'config'))
 
 
 @cli.command()
+@click.option('--timing', is_flag=True, help='Report where the time until launch is spent.')
 @click.pass_context
-def init(ctx):
+def init(ctx, timing):
     """Initiate manager (System)"""
     manager = ctx.obj or PatchboxModuleManager()
+    startup = get_process_age() if timing else None
+    start = time.perf_counter()
     try:
-        manager.init(ctx.meta['is_user'])
+        manager.init(ctx.meta['is_user'], timing=timing)
     except (ModuleManagerError, ModuleError) as err:
         raise click.ClickException(str(err))
+    if timing:
+        total = time.perf_counter() - start
+        if startup is not None:
+            click.echo('Timing: {:<22} {:8.1f} ms'.format('process startup', startup * 1000.0))
+            total += startup
+        for phase, seconds in manager.timings:
+            click.echo('Timing: {:<22} {:8.1f} ms'.format(phase, seconds * 1000.0))
+        click.echo('Timing: {:<22} {:8.1f} ms'.format('other (state, restarts)', (total - (startup or 0) - sum(t[1] for t in manager.timings)) * 1000.0))
+        click.echo('Timing: {:<22} {:8.1f} ms'.format('total', total * 1000.0))
 
 
 @cli.command()
 @click.argument('name', default='')
 @click.pass_context
+@read_only
 def list(ctx, name):
     """List available modules"""
     manager = ctx.obj
     if name:
         module = get_module_by_name(ctx, name)
         try:
-            lst = manager.list(module)
-            for l in lst:
-                click.echo(l)
-        except ModuleManagerError as err:
+            for item in manager.iter_list(module):
+                click.echo(item)
+        except (ModuleManagerError, ModuleError) as err:
             raise click.ClickException(str(err))
     else:
         for module in manager.get_all_modules():
@@ -65,6 +91,7 @@ def list(ctx, name):
 
 @cli.command()
 @click.pass_context
+@read_only
 def active(ctx):
     """Display active module"""
     active_name = ctx.obj.state.get('active_module')
@@ -72,18 +99,63 @@ def active(ctx):
         click.echo(active_name)
 
 
+def read_install_manifest(path):
+    # A JSON list of sources, each either a path/URL string or {"source": ..., "checksum": ...}.
+    try:
+        with open(path, 'rt') as f:
+            entries = json.load(f)
+    except (IOError, ValueError) as err:
+        raise click.ClickException('{} is not a valid manifest: {}'.format(path, err))
+    if isinstance(entries, dict):
+        entries = entries.get('modules', [])
+    installs = []
+    for entry in entries:
+        if isinstance(entry, dict) and entry.get('source'):
+            installs.append(PatchboxModuleInstall(entry['source'], entry.get('checksum')))
+        elif isinstance(entry, str):
+            installs.append(PatchboxModuleInstall(entry))
+        else:
+            raise click.ClickException('{} is not a valid manifest: unexpected entry {}'.format(path, entry))
+    return installs
+
+
 @cli.command()
 @click.pass_context
-@click.argument('path')
-def install(ctx, path):
-    """Install module from file"""
-    try:
-        ctx.obj.install(path)
-    except ModuleManagerError as err:
-        raise click.ClickException(str(err))
+@click.argument('paths', nargs=-1)
+@click.option('--checksum', help='Expected checksum of the module file, as sha256:<hex>.')
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), help='JSON list of sources to install.')
+@click.option('--jobs', type=int, help='Sources fetched and extracted at the same time.')
+@click.option('--script-jobs', type=int, help='Install scripts run at the same time.')
+@click.option('--force', is_flag=True, help='Reinstall even if the same source or content is already installed.')
+def install(ctx, paths, checksum, manifest, jobs, script_jobs, force):
+    """Install modules from files, URLs or git repositories"""
+    installs = [PatchboxModuleInstall(path) for path in paths]
+    if manifest:
+        installs += read_install_manifest(manifest)
+    if not installs:
+        raise click.UsageError('no module to install, pass a path or --manifest')
+    if checksum:
+        if len(installs) > 1:
+            raise click.UsageError('--checksum needs a single path, use a manifest for several')
+        installs[0].checksum = checksum
+
+    if len(installs) == 1 and not jobs and not script_jobs:
+        try:
+            ctx.obj.install(installs[0].path, checksum=installs[0].checksum, force=force)
+        except ModuleManagerError as err:
+            raise click.ClickException(str(err))
+        return
+
+    ctx.obj.install_many(installs, jobs=jobs, script_jobs=script_jobs, force=force)
+    ctx.obj.print_install_report(installs)
+    failed = [install for install in installs if install.status == 'failed']
+    if failed:
+        raise click.ClickException('{} of {} modules failed to install'.format(len(failed), len(installs)))
+
 
 @cli.command()
 @click.pass_context
+@read_only
 def status(ctx):
     """Module manager status"""
     click.echo(ctx.obj.status())
@@ -158,6 +230,24 @@ def restart(ctx):
         raise click.ClickException(str(err))
 
 
+@cli.command()
+@click.option('--once', is_flag=True, help='Check the active module once and exit.')
+@click.pass_context
+def watch(ctx, once):
+    """Restart the active module when its health checks fail (System)"""
+    if ctx.meta.get('daemon'):
+        # Runs until stopped, in its own process rather than tying up patchboxd.
+        raise InteractiveFallback()
+    from patchbox.health import PatchboxModuleWatcher
+    manager = ctx.obj
+    if not isinstance(manager, PatchboxModuleManager):
+        manager = PatchboxModuleManager()
+    try:
+        PatchboxModuleWatcher(manager).run(once=once)
+    except KeyboardInterrupt:
+        pass
+
+
 @cli.command()
 @click.pass_context
 def config(ctx):
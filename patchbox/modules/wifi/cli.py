@@ -5,7 +5,7 @@ import re
 import click
 import time
 from patchbox import settings
-from patchbox.utils import run_cmd, do_group_menu, do_ensure_param, do_go_back_if_ineractive
+from patchbox.utils import run_cmd, do_group_menu, do_ensure_param, do_go_back_if_ineractive, read_only
 
 
 def get_ifaces():
@@ -240,6 +240,7 @@ def disconnect():
 
 
 @cli.command()
+@read_only
 def status():
     """Display WiFi status"""
     if not is_wifi_supported():
@@ -275,7 +276,7 @@ def reconnect():
 @cli.command()
 @click.pass_context
 @click.option('--name', help='WiFi network name (SSID)', required=True, type=click.Choice(get_ssids))
-@click.option('--country', help='WiFi network country code (e.g. US, DE, LT)', type=click.Choice(get_wifi_countries()))
+@click.option('--country', help='WiFi network country code (e.g. US, DE, LT)', type=click.Choice(get_wifi_countries))
 @click.option('--password', help='WiFi network password (Leave empty for unsecure networks)')
 def connect(ctx, name, country, password):
     """Connect to WiFi network"""
@@ -346,6 +347,7 @@ def hotspot_disable():
 
 
 @hotspot.command('status')
+@read_only
 def hotspot_status():
     """Display WiFi hotspot status"""
     active = is_hotspot_active()
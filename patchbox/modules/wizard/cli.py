@@ -1,7 +1,6 @@
 import click
 import subprocess
-from patchbox.utils import run_interactive_cmd
-from patchbox.views import do_msgbox, do_yesno
+from patchbox.utils import run_interactive_cmd, do_msgbox, do_yesno
 from patchbox.modules.jack.cli import config as jack_config
 from patchbox.modules.password.cli import cli as password_config
 from patchbox.modules.wifi.cli import connect as wifi_connect
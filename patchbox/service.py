@@ -1,5 +1,9 @@
 from os import environ, path, symlink, remove, readlink
+from contextlib import contextmanager
+import re
+import time
 import dbus
+from patchbox import settings
 from patchbox.environment import PatchboxEnvironment as penviron
 
 class ServiceError(Exception):
@@ -9,12 +13,13 @@ class ServiceManagerError(Exception):
     pass
 
 class PatchboxDefaultServiceHandler:
-    def handle_activate(self, service):
+    def get_activate_action(self, service):
         if service.environ_param:
-            if penviron.get(service.environ_param, debug=False) != service.environ_value:
-                penviron.set(service.environ_param, service.environ_value)
-                return True
-        return False
+            return ['environment', service.environ_param, service.environ_value]
+        return None
+
+    def handle_activate(self, service):
+        return apply_service_action(self.get_activate_action(service))
 
     def handle_deactivate(self, service):
         if service.environ_param:
@@ -39,12 +44,25 @@ class PatchboxSymbolicLinkConfHandler(PatchboxDefaultServiceHandler):
             return True
         return False
 
-    def handle_activate(self, service):
-        return PatchboxSymbolicLinkConfHandler.update_symlink(service.environ_value or self.default_conf_file, self.conf_file)
+    def get_activate_action(self, service):
+        return ['symlink', service.environ_value or self.default_conf_file, self.conf_file]
 
     def handle_deactivate(self, service):
         return PatchboxSymbolicLinkConfHandler.update_symlink(self.default_conf_file, self.conf_file)
 
+def apply_service_action(action):
+    """Applies what get_activate_action returned, returns whether anything changed"""
+    if not action:
+        return False
+    if action[0] == 'environment':
+        if penviron.get(action[1], debug=False) != action[2]:
+            penviron.set(action[1], action[2])
+            return True
+        return False
+    if action[0] == 'symlink':
+        return PatchboxSymbolicLinkConfHandler.update_symlink(action[1], action[2])
+    raise ServiceError('unknown service action {}'.format(action[0]))
+
 def get_handler_for_service(service):
     if service.name == 'pisound-btn.service':
         return PatchboxSymbolicLinkConfHandler('/etc/pisound.conf', '/usr/local/etc/pisound.conf')
@@ -78,6 +96,13 @@ class PatchboxService(object):
     
     def __repr__(self):
         return '<PatchboxService: {}, {}, {}, {}>'.format(self.name, self.auto_start, self.environ_value, self.environ_param)
+
+    def get_declaration(self):
+        """The patchbox-module.json form of the service, PatchboxService(declaration) gives it back"""
+        declaration = {'service': self.name, 'auto_start': self.auto_start}
+        if self.environ_value:
+            declaration['config'] = self.environ_value
+        return declaration
     
     @staticmethod
     def get_env_param(service_name):
@@ -91,23 +116,326 @@ class PatchboxService(object):
 
 class PatchboxServiceManager(object):
 
+    SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+    SYSTEMD_OBJECT_PATH = "/org/freedesktop/systemd1"
+    MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+    PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
     UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
     SERVICE_UNIT_INTERFACE = "org.freedesktop.systemd1.Service"
 
-    def __init__(self):
-        self.__bus = dbus.SystemBus()
+    # Unit file states for which enabling or disabling the unit would change nothing.
+    ENABLED_UNIT_FILE_STATES = ['enabled', 'enabled-runtime', 'static', 'masked', 'masked-runtime', 'generated', 'transient', 'alias']
+    DISABLED_UNIT_FILE_STATES = ['disabled', 'static', 'masked', 'masked-runtime', 'generated', 'transient']
+
+    # Errors after which the bus connection and all proxies are re-created.
+    RECONNECT_ERRORS = [
+        "org.freedesktop.DBus.Error.Disconnected",
+        "org.freedesktop.DBus.Error.NoReply",
+        "org.freedesktop.DBus.Error.ServiceUnknown",
+        "org.freedesktop.DBus.Error.NameHasNoOwner"
+    ]
+    # Errors after which a cached unit object path is looked up again.
+    STALE_UNIT_ERRORS = [
+        "org.freedesktop.DBus.Error.UnknownObject",
+        "org.freedesktop.DBus.Error.UnknownMethod",
+        "org.freedesktop.DBus.Error.UnknownInterface"
+    ]
+    # Job results after which a unit isn't running as asked, 'timeout' also when it outlasted wait_jobs.
+    FAILED_JOB_RESULTS = ['failed', 'dependency', 'timeout']
+
+    def __init__(self, verbose=False, cache_properties=False):
+        self.__bus = None
+        self._manager = None
+        self._unit_paths = {}
+        self._unit_properties = {}
+        self.verbose = verbose
+        self.round_trips = 0
+        self.unit_file_changes = 0
+        self._glib = None
+        self._job_receiver = None
+        self._awaited_jobs = {}
+        self._finished_jobs = {}
+        self._subscribers = 0
+        # {(unit name, interface): properties}, kept up to date by PropertiesChanged when a main loop is
+        # available and otherwise only for the duration of the outermost operation.
+        self.cache_properties = cache_properties
+        self._cache = {}
+        self._cache_receivers = None
+        self._operation_depth = 0
+        # {name: (service, mode, [reasons])} of restarts deferred until the restart transaction commits.
+        self._restart_depth = 0
+        self._pending_restarts = {}
+        self._dependencies = {}
+
+    @property
+    def _bus(self):
+        # Connect on first use, so commands which never talk to systemd don't pay for it.
+        if self.__bus is None:
+            if settings.PATCHBOX_DBUS_ADDRESS:
+                from dbus.bus import BusConnection
+                self.__bus = BusConnection(settings.PATCHBOX_DBUS_ADDRESS, mainloop=self._get_mainloop())
+            else:
+                self.__bus = dbus.SystemBus(mainloop=self._get_mainloop())
+        return self.__bus
+
+    def _get_mainloop(self):
+        # JobRemoved signals need a GLib main loop, without one job completion is polled for.
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            from gi.repository import GLib
+        except ImportError:
+            return None
+        self._glib = GLib
+        return DBusGMainLoop()
+
+    def _reset(self):
+        self.__bus = None
+        self._manager = None
+        self._unit_paths = {}
+        self._unit_properties = {}
+        self._job_receiver = None
+        if self._cache_receivers is not None:
+            # Its receivers went with the connection, the next cached read subscribes again.
+            self._subscribers -= 1
+        self._cache = {}
+        self._cache_receivers = None
+
+    @contextmanager
+    def operation(self, name):
+        """Reports the number of D-Bus round trips made within the block in verbose mode"""
+        round_trips = self.round_trips
+        unit_file_changes = self.unit_file_changes
+        self._operation_depth += 1
+        try:
+            yield
+        finally:
+            self._operation_depth -= 1
+            if not self._operation_depth and self._cache_receivers is None:
+                self._cache = {}
+            if self.verbose:
+                print('Service: {} took {} D-Bus round trips, {} unit file reloads'.format(
+                    name, self.round_trips - round_trips, self.unit_file_changes - unit_file_changes))
+
+    def _call(self, method, unit_name=None):
+        """Calls method() once, retrying once after reconnecting or reloading a stale unit path"""
+        try:
+            self.round_trips += 1
+            return method()
+        except dbus.exceptions.DBusException as error:
+            if error.get_dbus_name() in self.RECONNECT_ERRORS:
+                self._reset()
+            elif unit_name and error.get_dbus_name() in self.STALE_UNIT_ERRORS:
+                path = self._unit_paths.pop(unit_name, None)
+                self._unit_properties.pop(path, None)
+            else:
+                raise
+        self.round_trips += 1
+        return method()
+
+    def _dispatch_signals(self):
+        if self._glib is not None and self.__bus is not None:
+            context = self._glib.MainContext.default()
+            while context.iteration(False):
+                pass
+
+    def _subscribe(self):
+        # systemd only emits unit and job signals while at least one subscription is held.
+        if not self._subscribers:
+            self._manager_call('Subscribe')
+        self._subscribers += 1
+
+    def _unsubscribe(self):
+        if not self._subscribers:
+            return
+        self._subscribers -= 1
+        if not self._subscribers:
+            try:
+                self._manager_call('Unsubscribe')
+            except dbus.exceptions.DBusException:
+                pass
+
+    def _get_cached(self, key, fetch):
+        if not self.cache_properties or (self._cache_receivers is None and not self._operation_depth):
+            return fetch()
+        self._dispatch_signals()
+        if key in self._cache:
+            return self._cache[key]
+        value = fetch()
+        if value:
+            self._cache[key] = value
+            self._watch_properties()
+        return value
+
+    def _watch_properties(self):
+        if self._cache_receivers is not None or self._glib is None:
+            return
+        try:
+            receivers = [
+                self._bus.add_signal_receiver(
+                    self._on_properties_changed, "PropertiesChanged", self.PROPERTIES_INTERFACE,
+                    self.SYSTEMD_BUS_NAME, path_keyword='path'),
+                self._bus.add_signal_receiver(
+                    self._on_unit_files_changed, "UnitFilesChanged", self.MANAGER_INTERFACE,
+                    self.SYSTEMD_BUS_NAME, self.SYSTEMD_OBJECT_PATH)
+            ]
+            self._subscribe()
+            # Set only once subscribed, _reset gives up the subscription along with the receivers.
+            self._cache_receivers = receivers
+        except dbus.exceptions.DBusException as error:
+            print(error)
+
+    def _on_properties_changed(self, interface, changed, invalidated, path=None):
+        interface = str(interface)
+        for name, unit_path in self._unit_paths.items():
+            if unit_path != path or (name, interface) not in self._cache:
+                continue
+            if invalidated:
+                del self._cache[(name, interface)]
+            else:
+                properties = dict(self._cache[(name, interface)])
+                properties.update(changed)
+                self._cache[(name, interface)] = properties
+
+    def _on_unit_files_changed(self):
+        for key in [key for key in self._cache if key[1] == 'UnitFileState']:
+            del self._cache[key]
+
+    def invalidate(self, names=None):
+        """Drops cached properties of the given units, or of all units"""
+        if names is None:
+            self._cache = {}
+            return
+        for key in [key for key in self._cache if key[0] in names]:
+            del self._cache[key]
+
+    def _get_interface(self):
+        if self._manager is None:
+            try:
+                # Without introspection creating the proxy doesn't touch the bus.
+                obj = self._bus.get_object(self.SYSTEMD_BUS_NAME,
+                                           self.SYSTEMD_OBJECT_PATH,
+                                           introspect=False)
+                self._manager = dbus.Interface(obj, self.MANAGER_INTERFACE)
+            except dbus.exceptions.DBusException as error:
+                print(error)
+                return None
+            if self._subscribers:
+                # Reconnected while subscriptions are held, systemd dropped them with the old connection.
+                try:
+                    self.round_trips += 1
+                    self._manager.Subscribe()
+                except dbus.exceptions.DBusException as error:
+                    print(error)
+        return self._manager
+
+    def _manager_call(self, name, *args):
+        def call():
+            interface = self._get_interface()
+            if interface is None:
+                raise ServiceManagerError('systemd is not reachable')
+            return getattr(interface, name)(*args)
+        return self._call(call)
 
     def start_unit(self, pservice, mode="replace"):
-        interface = self._get_interface()
-        if interface is None:
+        if self._get_interface() is None:
             return False
+        self._cancel_restart(pservice)
+        penviron.flush()
         try:
-            interface.StartUnit(pservice.name, mode)
+            self._manager_call('StartUnit', pservice.name, mode)
+            self.invalidate([pservice.name])
             print('Service: {} started'.format(pservice.name))
             return True
         except dbus.exceptions.DBusException as err:
             raise ServiceError(str(err))
 
+    @contextmanager
+    def restart_transaction(self, dry_run=False):
+        """Defers restarts requested within the block, restarting each unit at most once at the end
+
+        If the block raises, the deferred restarts are dropped and the error is passed on.
+        """
+        self._restart_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._restart_depth -= 1
+            if not self._restart_depth and self._pending_restarts:
+                print('Service: operation failed, dropping restarts of {}'.format(', '.join(self._pending_restarts)))
+                self._pending_restarts = {}
+                self._dependencies = {}
+            raise
+        self._restart_depth -= 1
+        if not self._restart_depth:
+            self.flush_restarts(dry_run)
+
+    def flush_restarts(self, dry_run=False):
+        """Runs the restarts deferred so far right away, for when something must not see the old services
+
+        Returns the names of the units which failed to restart.
+        """
+        plan = self.plan_restarts()
+        self._pending_restarts = {}
+        if not self._restart_depth:
+            self._dependencies = {}
+        if dry_run or self.verbose:
+            self.print_restart_plan(plan)
+        if dry_run:
+            return []
+        return self._execute_restart_plan(plan)
+
+    def add_dependencies(self, pservices, depends_on):
+        """Declares that pservices must be restarted after the services they depend on"""
+        for pservice in pservices:
+            self._dependencies.setdefault(pservice.name, set()).update(dependency.name for dependency in depends_on)
+
+    def plan_restarts(self):
+        """Returns the pending restarts as a list of steps, each step only depends on the ones before it"""
+        remaining = list(self._pending_restarts)
+        plan = []
+        while remaining:
+            step = [name for name in remaining if not self._dependencies.get(name, set()).intersection(remaining)]
+            if not step:
+                # Dependency cycle, restart whatever is left together.
+                step = remaining
+            plan.append([self._pending_restarts[name] for name in step])
+            remaining = [name for name in remaining if name not in step]
+        return plan
+
+    @staticmethod
+    def print_restart_plan(plan):
+        if not plan:
+            print('Service: restart plan is empty')
+        for i, step in enumerate(plan):
+            for pservice, mode, reasons in step:
+                print('Service: restart plan step {}: {} ({})'.format(i + 1, pservice.name, ', '.join(reasons)))
+
+    def _execute_restart_plan(self, plan):
+        failed = []
+        for step in plan:
+            jobs = {}
+            with self._job_signals():
+                for pservice, mode, reasons in step:
+                    jobs[pservice.name] = self._submit_job('RestartUnit', pservice, mode)
+                results = self.wait_jobs(jobs)
+            for name, (result, duration) in results.items():
+                print('Service: {} restarted ({}, {:.0f} ms)'.format(name, result, duration * 1000.0))
+            failed += self.get_failed_units(results)
+        if failed:
+            # Too late to undo anything, the restarts run as the operation commits.
+            print('Service: ERROR: failed to restart {}'.format(', '.join(failed)))
+        return failed
+
+    def _defer_restart(self, pservice, mode, reason):
+        pservice, mode, reasons = self._pending_restarts.setdefault(pservice.name, (pservice, mode, []))
+        reasons.append(reason or 'requested')
+        if self.verbose:
+            print('Service: {} restart deferred ({})'.format(pservice.name, reason or 'requested'))
+
+    def _cancel_restart(self, pservice):
+        # A unit being (re)started or stopped now makes an earlier restart request moot.
+        return self._pending_restarts.pop(pservice.name, None) is not None
+
     def enable_start_unit(self, pservice, mode="replace"):
         get_enabled = self.get_enabled(pservice)
         if get_enabled == 'masked':
@@ -121,9 +449,294 @@ class PatchboxServiceManager(object):
             return True
         else:
             if get_handler_for_service(pservice).handle_activate(pservice):
-                self.restart_unit(pservice, mode=mode)
+                self.restart_unit(pservice, mode=mode, reason='configuration changed')
         return True
 
+    @staticmethod
+    def get_configure_actions(pservices):
+        """Returns [[name, action...]] of what configure_units does for pservices, see apply_configure_actions"""
+        actions = []
+        for pservice in pservices:
+            action = get_handler_for_service(pservice).get_activate_action(pservice)
+            if action:
+                actions.append([pservice.name] + action)
+        return actions
+
+    @staticmethod
+    def apply_configure_actions(actions):
+        """Applies the result of get_configure_actions, returns the names of the services it changed"""
+        return set(action[0] for action in actions if apply_service_action(action[1:]))
+
+    @staticmethod
+    def configure_units(pservices):
+        """Applies the configuration of all services up front, returns the names of those it changed"""
+        return PatchboxServiceManager.apply_configure_actions(PatchboxServiceManager.get_configure_actions(pservices))
+
+    def enable_start_units(self, pservices, mode="replace", timeout=None, configured=None):
+        """Enables and starts all services at once, returns {name: (job result, seconds)} once the jobs finish
+
+        configured is the result of configure_units(), when their configuration was already applied.
+        Raises ServiceError naming the units which failed to start, after all jobs finished.
+        """
+        if not pservices or self._get_interface() is None:
+            return {}
+        units = self.get_units_status([pservice.name for pservice in pservices])
+        pservices = [pservice for pservice in pservices if not self._is_masked(pservice, units)]
+        self.enable_units([pservice for pservice in pservices if units[pservice.name]['active_state'] != 'active'], units)
+        jobs = {}
+        actions = {}
+        with self._job_signals():
+            for pservice in pservices:
+                unit = units[pservice.name]
+                if configured is None:
+                    changed = get_handler_for_service(pservice).handle_activate(pservice)
+                else:
+                    changed = pservice.name in configured
+                # Starting or restarting it now makes a restart deferred earlier in the transaction moot.
+                cancelled = self._cancel_restart(pservice)
+                if unit['active_state'] != 'active':
+                    jobs[pservice.name] = self._submit_job('StartUnit', pservice, mode)
+                    actions[pservice.name] = 'started'
+                elif changed or cancelled:
+                    # Folds a restart deferred earlier in the transaction into this one.
+                    jobs[pservice.name] = self._submit_job('RestartUnit', pservice, mode)
+                    actions[pservice.name] = 'restarted'
+            results = self.wait_jobs(jobs, timeout)
+
+        for name, (result, duration) in results.items():
+            print('Service: {} {} ({}, {:.0f} ms)'.format(name, actions[name], result, duration * 1000.0))
+        failed = self.get_failed_units(results)
+        if failed:
+            raise ServiceError('failed to start {}'.format(', '.join(
+                '{} ({})'.format(name, results[name][0]) for name in failed)))
+        return results
+
+    @staticmethod
+    def _is_masked(pservice, units):
+        if units[pservice.name]['unit_file_state'] == 'masked':
+            print('Skipping enabling {}, because it is masked. Unmask it by running `sudo systemctl unmask {}`'.format(pservice.name, pservice.name))
+            return True
+        return False
+
+    def enable_units(self, pservices, units=None):
+        """Enables all services which aren't enabled yet with a single EnableUnitFiles call"""
+        return self._change_unit_files(pservices, units, 'EnableUnitFiles', self.ENABLED_UNIT_FILE_STATES, 'enabled',
+                                       dbus.Boolean(False), dbus.Boolean(True))
+
+    def disable_units(self, pservices, units=None):
+        """Disables all services which are enabled with a single DisableUnitFiles call"""
+        return self._change_unit_files(pservices, units, 'DisableUnitFiles', self.DISABLED_UNIT_FILE_STATES, 'disabled',
+                                       dbus.Boolean(False))
+
+    def _change_unit_files(self, pservices, units, method, skip_states, action, *args):
+        if not pservices or self._get_interface() is None:
+            return False
+        if units is None:
+            units = self.get_units_status([pservice.name for pservice in pservices])
+        names = []
+        for pservice in pservices:
+            if units[pservice.name]['unit_file_state'] in skip_states:
+                continue
+            if pservice.name not in names:
+                names.append(pservice.name)
+        if not names:
+            return True
+        try:
+            self._manager_call(method, names, *args)
+            self.unit_file_changes += 1
+            self.invalidate(names)
+        except dbus.exceptions.DBusException as err:
+            raise ServiceError(str(err))
+        for name in names:
+            print('Service: {} {}'.format(name, action))
+        return True
+
+    def stop_disable_units(self, pservices):
+        """Stops the services one by one and disables them all at once"""
+        if not pservices:
+            return
+        units = self.get_units_status([pservice.name for pservice in pservices])
+        for pservice in pservices:
+            self.stop_unit(pservice)
+        self.disable_units(pservices, units)
+
+    def _submit_job(self, method, pservice, mode):
+        if method != 'StopUnit':
+            # Units read /etc/environment as they start, it must be written by then.
+            penviron.flush()
+        try:
+            job = str(self._manager_call(method, pservice.name, mode))
+        except dbus.exceptions.DBusException as err:
+            raise ServiceError(str(err))
+        self._awaited_jobs[job] = (pservice.name, time.monotonic())
+        self.invalidate([pservice.name])
+        return job
+
+    def _on_job_removed(self, job_id, job, unit, result):
+        job = str(job)
+        if job in self._awaited_jobs:
+            self._finished_jobs[job] = (str(result), time.monotonic())
+
+    @contextmanager
+    def _job_signals(self):
+        """Subscribes to JobRemoved signals for the duration of the block, if a main loop is available"""
+        subscribed = False
+        if self._get_interface() is not None and self._glib is not None:
+            try:
+                if self._job_receiver is None:
+                    self._job_receiver = self._bus.add_signal_receiver(
+                        self._on_job_removed, "JobRemoved", self.MANAGER_INTERFACE,
+                        self.SYSTEMD_BUS_NAME, self.SYSTEMD_OBJECT_PATH)
+                self._subscribe()
+                subscribed = True
+            except dbus.exceptions.DBusException as error:
+                print(error)
+        try:
+            yield subscribed
+        finally:
+            self._awaited_jobs = {}
+            self._finished_jobs = {}
+            if subscribed:
+                self._unsubscribe()
+
+    def wait_jobs(self, jobs, timeout=None):
+        """Waits for the {name: job path} jobs to finish, jobs still running at the deadline report 'timeout'"""
+        if timeout is None:
+            timeout = settings.PATCHBOX_SERVICE_JOB_TIMEOUT
+        deadline = time.monotonic() + timeout
+        pending = dict((job, name) for name, job in jobs.items())
+        results = {}
+        while pending:
+            if self._job_receiver is not None:
+                self._dispatch_signals()
+            else:
+                self._poll_jobs(pending)
+            for job in list(pending):
+                if job in self._finished_jobs:
+                    name = pending.pop(job)
+                    result, finished = self._finished_jobs[job]
+                    results[name] = (result, finished - self._awaited_jobs[job][1])
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(0.01 if self._job_receiver is not None else 0.05)
+        for job, name in pending.items():
+            results[name] = ('timeout', time.monotonic() - self._awaited_jobs[job][1])
+        # The jobs changed the units, don't serve their pre-job properties.
+        self.invalidate(list(jobs))
+        return results
+
+    @classmethod
+    def get_failed_units(cls, results):
+        """Returns the names of the units whose wait_jobs result is a failure"""
+        return sorted(name for name, (result, duration) in results.items() if result in cls.FAILED_JOB_RESULTS)
+
+    def _poll_jobs(self, pending):
+        names = [self._awaited_jobs[job][0] for job in pending]
+        try:
+            units = self._manager_call('ListUnitsByNames', names)
+        except dbus.exceptions.DBusException as error:
+            print(error)
+            return
+        running = set(str(unit[9]) for unit in units)
+        for unit in units:
+            for job in pending:
+                if job not in running and self._awaited_jobs[job][0] == str(unit[0]):
+                    result = 'failed' if str(unit[3]) == 'failed' else 'done'
+                    self._finished_jobs[job] = (result, time.monotonic())
+
+    @staticmethod
+    def _get_exec_property(argv):
+        return dbus.Array([(argv[0], dbus.Array(argv, signature='s'), False)], signature='(sasb)')
+
+    @staticmethod
+    def _get_environment():
+        # Transient units start with systemd's environment, hand over ours like a child process would get it.
+        return dbus.Array(['{}={}'.format(key, value) for key, value in environ.items()
+                           if re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', key) and '\n' not in value], signature='s')
+
+    def start_transient_unit(self, name, argv, stop_argv=None, notify=False, description=None):
+        """Runs argv as a transient service, returns (job result, seconds) once it's started, or ready with notify
+
+        The unit stays active after argv exits, so everything it leaves running is tracked in
+        its cgroup until stop_transient_unit. Returns None if systemd is not reachable.
+        """
+        if self._get_interface() is None:
+            return None
+        launch_timeout = settings.PATCHBOX_MODULE_LAUNCH_TIMEOUT
+        properties = [
+            ('Description', description or name),
+            ('ExecStart', self._get_exec_property(argv)),
+            ('Type', 'notify' if notify else 'simple'),
+            ('RemainAfterExit', True),
+            ('Environment', self._get_environment()),
+            ('TimeoutStartUSec', dbus.UInt64(int(launch_timeout * 1000000))),
+            ('TimeoutStopUSec', dbus.UInt64(int(settings.PATCHBOX_MODULE_STOP_TIMEOUT * 1000000))),
+            # Gone once stopped or failed, so the next launch can reuse the name.
+            ('CollectMode', 'inactive-or-failed')
+        ]
+        if notify:
+            # The launch script usually hands readiness over to a child, let any process of the unit report it.
+            properties.append(('NotifyAccess', 'all'))
+        if stop_argv:
+            properties.append(('ExecStop', self._get_exec_property(stop_argv)))
+
+        with self._job_signals():
+            try:
+                job = str(self._manager_call('StartTransientUnit', name, 'fail',
+                                             dbus.Array(properties, signature='(sv)'),
+                                             dbus.Array([], signature='(sa(sv))')))
+            except dbus.exceptions.DBusException as err:
+                raise ServiceError(str(err))
+            self._awaited_jobs[job] = (name, time.monotonic())
+            result, duration = self.wait_jobs({name: job}, launch_timeout + 5)[name]
+
+        if result == 'done':
+            # Without signals a job that failed is only told apart by the unit's state.
+            unit = self.get_units_status([name], unit_files=False)[name]
+            if unit['active_state'] not in ['active', 'activating', 'reloading']:
+                result = 'failed'
+        print('Service: {} started ({}, {:.0f} ms)'.format(name, result, duration * 1000.0))
+        return result, duration
+
+    def stop_transient_unit(self, name):
+        """Stops a unit started by start_transient_unit, returns (job result, seconds), None if it wasn't running
+
+        The unit's ExecStop runs first, whatever is still left in its cgroup after
+        PATCHBOX_MODULE_STOP_TIMEOUT gets SIGKILL.
+        """
+        if self._get_interface() is None:
+            return None
+        unit = self.get_units_status([name], unit_files=False)[name]
+        if unit['load_state'] != 'loaded' or unit['active_state'] in ['inactive', 'failed']:
+            return None
+        with self._job_signals():
+            job = self._submit_job('StopUnit', PatchboxService(name), 'replace')
+            result, duration = self.wait_jobs({name: job}, settings.PATCHBOX_MODULE_STOP_TIMEOUT + 5)[name]
+        print('Service: {} stopped ({}, {:.0f} ms)'.format(name, result, duration * 1000.0))
+        return result, duration
+
+    def get_unit_pids(self, name):
+        """Returns the ids of the processes in the unit's cgroup, None if they can't be told"""
+        if self._get_interface() is None:
+            return None
+        try:
+            cgroup = str(self._call(lambda: self._get_unit_properties_interface(name).Get(
+                self.SERVICE_UNIT_INTERFACE, 'ControlGroup'), unit_name=name))
+        except dbus.exceptions.DBusException as error:
+            print(error)
+            return None
+        if not cgroup:
+            # Units which aren't running have no cgroup.
+            return []
+        # The unified hierarchy first, then the systemd one of cgroup v1 setups.
+        for root in ['/sys/fs/cgroup', '/sys/fs/cgroup/unified', '/sys/fs/cgroup/systemd']:
+            try:
+                with open(root + cgroup + '/cgroup.procs', 'rt') as f:
+                    return [int(pid) for pid in f.read().split()]
+            except (IOError, OSError, ValueError):
+                continue
+        return None
+
     def stop_disable_unit(self, pservice):
         if not self.stop_unit(pservice):
             pass
@@ -131,76 +744,127 @@ class PatchboxServiceManager(object):
             pass
 
     def stop_unit(self, pservice, mode="replace"):
-        interface = self._get_interface()
-
-        if interface is None:
+        if self._get_interface() is None:
             return False
+        self._cancel_restart(pservice)
         try:
-            interface.StopUnit(pservice.name, mode)
+            self._manager_call('StopUnit', pservice.name, mode)
+            self.invalidate([pservice.name])
             get_handler_for_service(pservice).handle_activate(pservice)
             print('Service: {} stopped'.format(pservice.name))
             return True
         except dbus.exceptions.DBusException as err:
             raise ServiceError(str(err))
-    
+
     def reset_unit_environment(self, pservice):
         if get_handler_for_service(pservice).handle_deactivate(pservice):
-            self.restart_unit(pservice)
+            self.restart_unit(pservice, reason='configuration reset')
 
-    def restart_unit(self, pservice, mode="replace"):
-        interface = self._get_interface()
-        if interface is None:
+    def restart_unit(self, pservice, mode="replace", reason=None):
+        if self._get_interface() is None:
             return False
+        if self._restart_depth:
+            self._defer_restart(pservice, mode, reason)
+            return True
+        self._cancel_restart(pservice)
+        penviron.flush()
         try:
-            interface.RestartUnit(pservice.name, mode)
+            self._manager_call('RestartUnit', pservice.name, mode)
+            self.invalidate([pservice.name])
             print('Service: {} restarted'.format(pservice.name))
             return True
         except dbus.exceptions.DBusException as err:
             raise ServiceError(str(err))
 
     def enable_unit(self, pservice):
-        interface = self._get_interface()
-        if interface is None:
+        if self._get_interface() is None:
             return False
         try:
-            interface.EnableUnitFiles([pservice.name],
-                                      dbus.Boolean(False),
-                                      dbus.Boolean(True))
+            self._manager_call('EnableUnitFiles', [pservice.name],
+                               dbus.Boolean(False),
+                               dbus.Boolean(True))
+            self.invalidate([pservice.name])
             print('Service: {} enabled'.format(pservice.name))
             return True
         except dbus.exceptions.DBusException as err:
             raise ServiceError(str(err))
 
     def disable_unit(self, pservice):
-        interface = self._get_interface()
-        if interface is None:
+        if self._get_interface() is None:
             return False
         try:
-            interface.DisableUnitFiles([pservice.name], dbus.Boolean(False))
+            self._manager_call('DisableUnitFiles', [pservice.name], dbus.Boolean(False))
+            self.invalidate([pservice.name])
             print('Service: {} disabled'.format(pservice.name))
             return True
         except dbus.exceptions.DBusException as err:
             raise ServiceError(str(err))
 
     def _get_unit_file_state(self, pservice):
-        interface = self._get_interface()
-        if interface is None:
+        if self._get_interface() is None:
             return None
         try:
-            state = interface.GetUnitFileState(pservice.name)
+            state = self._get_cached((pservice.name, 'UnitFileState'),
+                                     lambda: self._manager_call('GetUnitFileState', pservice.name))
             return state
         except dbus.exceptions.DBusException as error:
             print(error)
             return False
 
-    def _get_interface(self):
+    @staticmethod
+    def _get_unit_name(name):
+        return name if '.' in name else name + '.service'
+
+    def get_units_status(self, names, unit_files=True):
+        """Returns {name: {active_state, sub_state, load_state, unit_file_state}} for all units at once"""
+        units = dict((name, self._get_unit_name(name)) for name in names)
+        result = dict((name, {
+            'load_state': None,
+            'active_state': None,
+            'sub_state': None,
+            'unit_file_state': None
+        }) for name in names)
+        if not units or self._get_interface() is None:
+            return result
+        unit_names = list(set(units.values()))
         try:
-            obj = self.__bus.get_object("org.freedesktop.systemd1",
-                                        "/org/freedesktop/systemd1")
-            return dbus.Interface(obj, "org.freedesktop.systemd1.Manager")
+            loaded = {}
+            for unit in self._manager_call('ListUnitsByNames', unit_names):
+                loaded[str(unit[0])] = (str(unit[2]), str(unit[3]), str(unit[4]))
+            files = {}
+            if unit_files:
+                for unit_path, state in self._manager_call('ListUnitFilesByPatterns', [], unit_names):
+                    files[path.basename(str(unit_path))] = str(state)
         except dbus.exceptions.DBusException as error:
-            print(error)
-            return None
+            if error.get_dbus_name() != "org.freedesktop.DBus.Error.UnknownMethod":
+                print(error)
+                return result
+            # systemd older than v230, query the units one by one.
+            return self._get_units_status_slow(names, unit_files)
+        for name, unit_name in units.items():
+            if unit_name in loaded:
+                load_state, active_state, sub_state = loaded[unit_name]
+                result[name].update({
+                    'load_state': load_state,
+                    'active_state': active_state,
+                    'sub_state': sub_state
+                })
+            result[name]['unit_file_state'] = files.get(unit_name)
+        return result
+
+    def _get_units_status_slow(self, names, unit_files):
+        result = {}
+        for name in names:
+            pservice = PatchboxService(self._get_unit_name(name))
+            properties = self._get_unit_properties(pservice, self.UNIT_INTERFACE) or {}
+            state = self._get_unit_file_state(pservice) if unit_files else None
+            result[name] = {
+                'load_state': str(properties['LoadState']) if 'LoadState' in properties else None,
+                'active_state': str(properties['ActiveState']) if 'ActiveState' in properties else None,
+                'sub_state': str(properties['SubState']) if 'SubState' in properties else None,
+                'unit_file_state': str(state) if state else None
+            }
+        return result
 
     def get_active_state(self, pservice):
         properties = self._get_unit_properties(pservice, self.UNIT_INTERFACE)
@@ -255,26 +919,40 @@ class PatchboxServiceManager(object):
             return False
 
     def _get_unit_state(self, pservice):
-        interface = self._get_interface()
-        if interface is None:
+        if self._get_interface() is None:
             return None
         try:
-            return interface.GetUnitFileState(pservice.name)
+            return self._get_cached((pservice.name, 'UnitFileState'),
+                                    lambda: self._manager_call('GetUnitFileState', pservice.name))
         except dbus.exceptions.DBusException as error:
             print(error)
             return None
 
-    def _get_unit_properties(self, pservice, unit_interface):
-        interface = self._get_interface()
+    def _get_unit_properties_interface(self, unit_name):
+        path = self._unit_paths.get(unit_name)
+        if path is None:
+            # Called within the caller's _call, which retries the whole lookup, so LoadUnit goes
+            # through the proxy directly and is counted here once.
+            interface = self._get_interface()
+            if interface is None:
+                raise ServiceManagerError('systemd is not reachable')
+            self.round_trips += 1
+            path = interface.LoadUnit(unit_name)
+            self._unit_paths[unit_name] = path
+        interface = self._unit_properties.get(path)
         if interface is None:
+            obj = self._bus.get_object(self.SYSTEMD_BUS_NAME, path, introspect=False)
+            interface = dbus.Interface(obj, self.PROPERTIES_INTERFACE)
+            self._unit_properties[path] = interface
+        return interface
+
+    def _get_unit_properties(self, pservice, unit_interface):
+        if self._get_interface() is None:
             return None
         try:
-            unit_path = interface.LoadUnit(pservice.name)
-            obj = self.__bus.get_object(
-                "org.freedesktop.systemd1", unit_path)
-            properties_interface = dbus.Interface(
-                obj, "org.freedesktop.DBus.Properties")
-            return properties_interface.GetAll(unit_interface)
+            return self._get_cached((pservice.name, unit_interface), lambda: self._call(
+                lambda: self._get_unit_properties_interface(pservice.name).GetAll(unit_interface),
+                unit_name=pservice.name))
         except dbus.exceptions.DBusException as error:
             print(error)
             return None
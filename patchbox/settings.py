@@ -9,12 +9,56 @@ CFG_SCRIPTS_DIR = os.environ.get("CFG_SCRIPTS_DIR", path + '/scripts/')
 BTN_SCRIPTS_DIR = os.environ.get("BTN_SCRIPTS", '/usr/local/pisound/scripts/pisound-btn')
 BTN_CFG = os.environ.get("BTN_CFG", '/etc/pisound.conf')
 
+# Patchbox State
+PATCHBOX_STATE_DIR = os.environ.get('PATCHBOX_STATE_DIR', '/var/patchbox/')
+PATCHBOX_STATE_FILE = 'state.json'
+
 # Patchbox Modules
 PATCHBOX_MODULE_FOLDER = '/usr/local/patchbox-modules/'
-PATCHBOX_MODULE_TMP_FOLDER = '/var/patchbox/tmp/'
+PATCHBOX_MODULE_TMP_FOLDER = PATCHBOX_STATE_DIR + 'tmp/'
 PATCHBOX_MODULE_IGNORED = ['system', 'tmp', 'imported']
 PATCHBOX_MODULE_FILE = 'patchbox-module.json'
 PATCHBOX_MODULE_REQUIRED_KEYS = ['name', 'description', 'version', 'author']
+PATCHBOX_MODULE_INDEX = PATCHBOX_STATE_DIR + 'module-index.json'
+PATCHBOX_BOOT_PLAN = PATCHBOX_STATE_DIR + 'boot-plan.json'
+PATCHBOX_GIT_CACHE = PATCHBOX_STATE_DIR + 'git-cache/'
+PATCHBOX_LIST_CACHE_FOLDER = PATCHBOX_STATE_DIR + 'list-cache/'
+PATCHBOX_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PATCHBOX_DOWNLOAD_TIMEOUT = 30
+PATCHBOX_DOWNLOAD_RETRIES = 5
+PATCHBOX_INSTALL_JOBS = 4
+# Install scripts mostly run apt-get, which fails rather than waits while another one holds the dpkg lock.
+PATCHBOX_INSTALL_SCRIPT_JOBS = 1
+PATCHBOX_MODULE_LAUNCH_TIMEOUT = 30
+PATCHBOX_MODULE_STOP_TIMEOUT = 10
+# Defaults for the "health" section of patchbox-module.json, times are in seconds.
+PATCHBOX_HEALTH_INTERVAL = 5
+PATCHBOX_HEALTH_TIMEOUT = 2
+PATCHBOX_HEALTH_GRACE = 10
+PATCHBOX_HEALTH_FAILURES = 2
+PATCHBOX_HEALTH_BACKOFF_MIN = 2
+PATCHBOX_HEALTH_BACKOFF_MAX = 300
+# A module running this long since its last restart gets its restart backoff reset.
+PATCHBOX_HEALTH_STABLE_TIME = 60
+# Runs `module watch`, only while the active module has a "health" section.
+PATCHBOX_WATCH_SERVICE = 'patchbox-watch.service'
 
-PATCHBOX_STATE_DIR = '/var/patchbox/'
-PATCHBOX_STATE_FILE = 'state.json'
+# Environment
+PATCHBOX_ENVIRONMENT_FILE = os.environ.get('PATCHBOX_ENVIRONMENT_FILE', '/etc/environment')
+PATCHBOX_ENVIRONMENT_LOCK = PATCHBOX_STATE_DIR + 'environment.lock'
+
+# Patchbox CLI
+PATCHBOX_CLI_MANIFEST = PATCHBOX_STATE_DIR + 'cli-manifest.json'
+PATCHBOX_CLI_MANIFEST_USER = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'patchbox', 'cli-manifest.json')
+PATCHBOX_STARTUP_BUDGET_MS = int(os.environ.get('PATCHBOX_STARTUP_BUDGET_MS', 500))
+
+# Patchbox Services
+PATCHBOX_SERVICE_JOB_TIMEOUT = 90
+# Talk to systemd (or tools/fake_systemd.py) on this bus instead of the system bus.
+PATCHBOX_DBUS_ADDRESS = os.environ.get('PATCHBOX_DBUS_ADDRESS')
+
+# Patchbox Daemon
+PATCHBOX_DAEMON_SOCKET = os.environ.get('PATCHBOX_DAEMON_SOCKET', '/run/patchbox/patchboxd.sock')
+PATCHBOX_DAEMON_GROUP = os.environ.get('PATCHBOX_DAEMON_GROUP', 'sudo')
+# Command groups patchboxd may be asked to run, of which it only serves the read-only commands.
+PATCHBOX_DAEMON_COMMANDS = ['bluetooth', 'button', 'info', 'jack', 'module', 'wifi']
@@ -0,0 +1,60 @@
+import builtins
+import os
+import sys
+import time
+
+
+class PatchboxStartupProfiler(object):
+    """Measures the time spent importing modules until the command starts running"""
+
+    ENV_START_TIME = 'PATCHBOX_STARTUP_T0'
+
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self.start_time = float(os.environ.get(self.__class__.ENV_START_TIME, time.time()))
+        self.imports = []
+        self._stack = []
+        self._import = None
+
+    @classmethod
+    def install(cls, budget_ms):
+        profiler = cls(budget_ms)
+        # Keep the start time of the first process across the sudo re-exec.
+        os.environ[cls.ENV_START_TIME] = str(profiler.start_time)
+        profiler._import = builtins.__import__
+        builtins.__import__ = profiler._profiled_import
+        return profiler
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _profiled_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports.append((name, elapsed - children, elapsed, len(self._stack)))
+
+    def report(self, file=None, limit=25):
+        file = file or sys.stderr
+        self.uninstall()
+        total_ms = (time.time() - self.start_time) * 1000.0
+        import_ms = sum(i[2] for i in self.imports if i[3] == 0) * 1000.0
+
+        print('Startup: {:>9} {:>9}  module'.format('self ms', 'cumul ms'), file=file)
+        for name, own, cumulative, depth in sorted(self.imports, key=lambda i: i[2], reverse=True)[:limit]:
+            print('Startup: {:9.1f} {:9.1f}  {}'.format(own * 1000.0, cumulative * 1000.0, name), file=file)
+        print('Startup: {} modules imported in {:.1f} ms'.format(len(self.imports), import_ms), file=file)
+        print('Startup: {:.1f} ms until command start, budget {} ms{}'.format(
+            total_ms, self.budget_ms, ' (OVER BUDGET)' if total_ms > self.budget_ms else ''), file=file)
+        return total_ms <= self.budget_ms
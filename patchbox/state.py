@@ -1,7 +1,8 @@
 import json
 import os
-import dbus
+from contextlib import contextmanager
 from patchbox.environment import PatchboxEnvironment as penviron
+from patchbox.lock import PatchboxFileLock
 from patchbox import settings
 
 class PatchboxModuleStateManager(object):
@@ -9,52 +10,149 @@ class PatchboxModuleStateManager(object):
     STATE_DIR = settings.PATCHBOX_STATE_DIR
     STATE_FILE = settings.PATCHBOX_STATE_FILE
 
+    @staticmethod
+    def default_state():
+        return {'type': 'PatchboxModuleManagerStateFile', 'modules': {}}
+
+    @staticmethod
+    def write_state_file(path, data):
+        # Write a sibling temp file and rename it over the state, so a power cut never leaves a truncated file.
+        state_dir = os.path.dirname(path) or '.'
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wt') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        dir_fd = os.open(state_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
     @staticmethod
     def init_state_file(path):
-        with open(path, 'wt') as f:
-            json.dump(
-                {'type': 'PatchboxModuleManagerStateFile', 'modules': {}}, f)
+        PatchboxModuleStateManager.write_state_file(path, PatchboxModuleStateManager.default_state())
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, read_only=False):
         self.path = path or self.__class__.STATE_DIR + \
             self.__class__.STATE_FILE
-        if not os.path.isfile(self.path):
-            if not os.path.exists(self.__class__.STATE_DIR):
-                os.makedirs(self.__class__.STATE_DIR)
-            self.init_state_file(self.path)
-            with open(self.path, 'w') as f:
-                json.dump(
-                    {'type': 'PatchboxModuleManagerStateFile', 'modules': {}}, f)
-        with open(self.path, 'rt') as f:
-            try:
-                self.data = json.load(f)
-            except:
-                self.init_state_file(self.path)
+        # Read-only state is used by unprivileged commands, changes are kept in memory only.
+        self.read_only = read_only
+        self._stat = None
+        self._dirty = False
+        # [(param, value, module_name)] set since the last commit, replayed onto newer state found on disk.
+        self._changes = []
+        self._transaction_depth = 0
+        self._lock = PatchboxFileLock(self.path + '.lock')
+        self.load()
+
+    def _get_stat(self):
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        # state.json is only ever replaced with a rename, so reads need no lock.
+        try:
+            with open(self.path, 'rt') as f:
+                st = os.fstat(f.fileno())
+                self._stat = (st.st_ino, st.st_mtime_ns, st.st_size)
                 self.data = json.load(f)
+            self._dirty = False
+        except (IOError, OSError):
+            # Missing state file, it gets created by the first commit.
+            self._stat = None
+            self.data = self.default_state()
+            self._dirty = True
+        except ValueError:
+            print('State: {} is not valid, resetting'.format(self.path))
+            self.data = self.default_state()
+            self._dirty = True
+
+    def refresh(self):
+        """Reloads the state if the file was changed by another process"""
+        if self._transaction_depth:
+            return
+        try:
+            if self._get_stat() == self._stat:
+                return
+        except OSError:
+            return
+        self.load()
+
+    @contextmanager
+    def transaction(self):
+        """Batches all changes made within the block into a single write
+
+        The outermost transaction picks up changes committed by other processes before
+        any of its own are made. No lock is held while the block runs, see commit().
+        """
+        if not self._transaction_depth:
+            self.refresh()
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.commit()
+
+    def commit(self):
+        """Writes the changes, on top of whatever other processes committed since the state was read
+
+        The exclusive lock is only held for this read-modify-write.
+        """
+        if not (self._dirty or self._changes) or self.read_only:
+            return
+        with self._lock.exclusive():
+            try:
+                stat = self._get_stat()
+            except OSError:
+                stat = None
+            if stat is not None and stat != self._stat:
+                changes = self._changes
+                self.load()
+                for param, value, module_name in changes:
+                    self._apply(self.data, param, value, module_name)
+            self.write_state_file(self.path, self.data)
+            self._stat = self._get_stat()
+        self._changes = []
+        self._dirty = False
+
+    @staticmethod
+    def _apply(data, param, value, module_name=None):
+        if module_name:
+            data.setdefault('modules', {}).setdefault(module_name, {})[param] = value
+        else:
+            data[param] = value
 
     def set(self, param, value, module_name=None):
+        with self.transaction():
+            self._set(param, value, module_name)
+
+    def _set(self, param, value, module_name=None):
         if module_name:
-            try:
-                current_value = self.data.get('modules').get(module_name, dict()).get(param)
-                if current_value == value:
-                    print('State: {} module {} {} -> {} (skip)'.format(module_name, param, current_value, value))
-                    return
-                self.data.get('modules')[module_name][param] = value
-                print('State: {} module {} {} -> {}'.format(module_name, param, current_value, value))
-            except KeyError:
-                self.data.get('modules')[module_name] = {}
-                self.data.get('modules')[module_name][param] = value
-                print('State: {} module {} None -> {}'.format(module_name, param, value))
+            current_value = self.data.get('modules').get(module_name, dict()).get(param)
+            if current_value == value:
+                print('State: {} module {} {} -> {} (skip)'.format(module_name, param, current_value, value))
+                return
+            print('State: {} module {} {} -> {}'.format(module_name, param, current_value, value))
         else:
             current_value = self.data.get(param)
             if current_value == value:
                 print('State: {} {} -> {} (skip)'.format(param, current_value, value))
                 return
-            self.data[param] = value
             print('State: {} {} -> {}'.format(param, current_value, value))
 
-        with open(self.path, 'w') as f:
-            json.dump(self.data, f)
+        self._apply(self.data, param, value, module_name)
+        self._changes.append((param, value, module_name))
 
     def get(self, param, module_name=None):
         if module_name:
@@ -62,6 +160,8 @@ class PatchboxModuleStateManager(object):
         return self.data.get(param)
 
     def set_active_module(self, module_name):
+        if self.read_only:
+            raise PermissionError('the active module can only be changed by root')
         if module_name == None:
             active_name = self.get('active_module')
             self.set('active_module', None)
@@ -4,9 +4,46 @@ import os
 from os.path import isfile
 from inspect import isfunction
 import click
-from patchbox import views
+from click.utils import make_default_short_help
+from patchbox.manifest import PatchboxCommandManifest
 from click.termui import prompt, confirm
-from patchbox.views import do_msgbox, do_yesno
+
+
+class InteractiveFallback(Exception):
+	"""Raised when a dialog is needed while running inside patchboxd"""
+	pass
+
+
+def _ensure_dialogs_available():
+	ctx = click.get_current_context(silent=True)
+	if ctx is not None and ctx.meta.get('daemon'):
+		raise InteractiveFallback()
+
+
+# The dialogs are backed by urwid, which is only imported once a dialog is shown.
+def do_menu(*args, **kwargs):
+	_ensure_dialogs_available()
+	from patchbox import views
+	return views.do_menu(*args, **kwargs)
+
+
+def do_inputbox(*args, **kwargs):
+	_ensure_dialogs_available()
+	from patchbox import views
+	return views.do_inputbox(*args, **kwargs)
+
+
+def do_msgbox(*args, **kwargs):
+	_ensure_dialogs_available()
+	from patchbox import views
+	return views.do_msgbox(*args, **kwargs)
+
+
+def do_yesno(*args, **kwargs):
+	_ensure_dialogs_available()
+	from patchbox import views
+	return views.do_yesno(*args, **kwargs)
+
 
 class PatchboxChoice(click.ParamType):
 	"""Dictionary support for click.Choice"""
@@ -57,7 +94,7 @@ class PatchboxChoice(click.ParamType):
 		else:
 			choices = self.choices
 
-		if self.type == 'dict':
+		if self.type == 'dict' or (self.type == 'callback' and choices and isinstance(choices[0], dict)):
 			for c in choices:
 				if c.get('value') == value:
 					return c
@@ -108,25 +145,64 @@ class PatchboxHomeGroup(click.MultiCommand):
 
 	def __init__(self, *args, **kwargs):
 		self.is_home = True
+		self.manifest = PatchboxCommandManifest(modules_folder)
 		super(PatchboxHomeGroup, self).__init__(
 			invoke_without_command=True, *args, **kwargs)
 
 	def list_commands(self, ctx):
-		rv = []
-		for module in next(os.walk(modules_folder))[1]:
-			if os.path.isfile(os.path.join(modules_folder, module, 'cli.py')):
-				rv.append(module)
-		rv.sort()
-		return rv
+		return self.manifest.get_names()
 
 	def get_command(self, ctx, name):
 		if sys.version_info[0] == 2:
 			name = name.encode('ascii', 'replace')
+		if name not in self.list_commands(ctx):
+			return None
 		mod = __import__('patchbox.modules.{}.cli'.format(name),
 							None, None, ['cli'])
 
 		return mod.cli
 
+	def is_read_only(self, args):
+		info = self.manifest.resolve(args)
+		return bool(info and info.get('read_only'))
+
+	def format_commands(self, ctx, formatter):
+		commands = []
+		for name in self.list_commands(ctx):
+			info = self.manifest.get_command(name)
+			if info.get('hidden'):
+				continue
+			commands.append((name, info))
+
+		if commands:
+			limit = formatter.width - 6 - max(len(name) for name, info in commands)
+			rows = []
+			for name, info in commands:
+				help = info.get('short_help') or make_default_short_help(info.get('help') or '', limit)
+				rows.append((name, help.strip()))
+			with formatter.section('Commands'):
+				formatter.write_dl(rows)
+
+
+def read_only(f):
+	"""Marks a command as safe to run without root privileges"""
+	f.__patchbox_read_only__ = True
+	return f
+
+
+def get_command_description(ctx, name):
+	"""Returns the menu description of a subcommand, from the manifest if possible"""
+	path = [name]
+	context = ctx
+	while context.parent is not None:
+		path.insert(0, context.info_name)
+		context = context.parent
+	if isinstance(context.command, PatchboxHomeGroup):
+		info = context.command.manifest.get_command(path)
+		if info is not None:
+			return info.get('doc')
+	return ctx.command.get_command(ctx, name).__doc__
+
 
 def run_cmd(list, silent=True):
 	""" Runs bash command, returns is_error, output"""
@@ -182,7 +258,7 @@ def do_group_menu(ctx, cancel=None, ok=None):
 			commands = ctx.command.list_commands(ctx)
 			for command in commands:
 				options.append({'key': command, 'value': command,
-								'description': ctx.command.get_command(ctx, command).__doc__})
+								'description': get_command_description(ctx, command)})
 			if not cancel and ctx.parent:
 				cancel = 'Back'
 			description = ctx.command.help + ctx.meta.get('additional_description', '')
@@ -190,7 +266,7 @@ def do_group_menu(ctx, cancel=None, ok=None):
 				del ctx.meta['additional_description']
 			except KeyError:
 				pass
-			close, output = views.do_menu(
+			close, output = do_menu(
 				description, options, ok=ok, cancel=cancel)
 			if close:
 				go_home_or_exit(ctx)
@@ -231,7 +307,7 @@ def do_ensure_param(ctx, name):
 		return value
 
 	if isinstance(param.type, click.Choice):
-		close, value = views.do_menu(
+		close, value = do_menu(
 			message, param.type.get_choices(), cancel='Cancel')
 		if param.type == dict:
 			for option in param.choices:
@@ -239,10 +315,10 @@ def do_ensure_param(ctx, name):
 					value = option
 
 	if isinstance(param.type, click.types.StringParamType):
-		close, value = views.do_inputbox(message)
+		close, value = do_inputbox(message)
 
 	if isinstance(param.type, click.types.IntParamType):
-		close, value = views.do_inputbox(message)
+		close, value = do_inputbox(message)
 
 	if close:
 		go_home_or_exit(ctx)
@@ -284,6 +360,18 @@ def get_system_service_property(name, prop):
 	return subprocess.check_output(['systemctl', 'show', '-p', prop, '--value', name]).strip().decode('utf-8')
 
 
+def get_system_services_status(names, unit_files=False):
+	"""Returns the state of the given systemd units, queried in a single batch"""
+	ctx = click.get_current_context(silent=True)
+	manager = ctx.meta.get('module_manager') if ctx is not None else None
+	if manager is not None:
+		service_manager = manager._service_manager
+	else:
+		from patchbox.service import PatchboxServiceManager
+		service_manager = PatchboxServiceManager()
+	return service_manager.get_units_status(names, unit_files=unit_files)
+
+
 def run_interactive_cmd(ctx, command=None, args=None, message="Let's begin!", error="Oops! Something ain't right. Let's try again.", required=False):
 	if required:
 		do_msgbox(message)
@@ -46,7 +46,8 @@ setup(
 	],
 	entry_points='''
 		[console_scripts]
-		patchbox-config=patchbox.cli:cli
-		patchbox=patchbox.cli:cli
+		patchbox-config=patchbox.client:main
+		patchbox=patchbox.client:main
+		patchboxd=patchbox.daemon:main
 	''',
 )
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Benchmarks module archive installs: the old extract, copy and delete against single pass extraction
+
+Builds a synthetic module archive in a temporary folder and installs it into a
+throwaway imported/ folder, timing each way and counting the bytes written:
+
+    tools/bench_archive.py --files 2000 --size 64 --format tgz --runs 5
+
+"old" is what install did before: sniff the file as tar and as zip, extract
+everything into the tmp folder, copy the tree into imported/ and delete the
+temporary copy. "new" is extract_archive into a staging folder next to
+imported/ and a rename. "upgrade" is "new" over an installed copy of the same
+module, where unchanged files are hard linked.
+"""
+import argparse
+import glob
+import io
+import os
+import shutil
+import statistics
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import redirect_stdout
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+MODULE_NAME = 'bench-module'
+
+
+def create_archive(work_dir, files, size, archive_format):
+    source = os.path.join(work_dir, 'source')
+    module_path = os.path.join(source, MODULE_NAME)
+    for i in range(files):
+        path = os.path.join(module_path, 'dir-{}'.format(i % 20), 'file-{}.bin'.format(i))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size * 1024))
+    with open(os.path.join(module_path, 'patchbox-module.json'), 'w') as f:
+        f.write('{"name": "bench-module", "version": "1.0.0"}')
+
+    path = os.path.join(work_dir, 'module.' + archive_format)
+    if archive_format == 'zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for root, dirs, names in os.walk(module_path):
+                for name in sorted(names):
+                    full_path = os.path.join(root, name)
+                    zip_file.write(full_path, os.path.relpath(full_path, source))
+    else:
+        mode = {'tar': 'w', 'tgz': 'w:gz', 'txz': 'w:xz'}[archive_format]
+        with tarfile.open(path, mode) as tar:
+            tar.add(module_path, MODULE_NAME)
+    return path
+
+
+def get_written_bytes():
+    # Bytes passed to write(), the page cache hides most of the actual disk writes.
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+def install_old(archive, tmp_dir, imp_path):
+    os.makedirs(tmp_dir)
+    is_tar = tarfile.is_tarfile(archive)
+    is_zip = zipfile.is_zipfile(archive)
+    if is_tar:
+        with tarfile.open(archive) as tar:
+            tar.extractall(path=tmp_dir)
+    if is_zip:
+        with zipfile.ZipFile(archive) as zip_file:
+            zip_file.extractall(tmp_dir)
+    module_name = os.path.basename(glob.glob(tmp_dir + '/*')[0])
+    target = os.path.join(imp_path, module_name)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    shutil.copytree(os.path.join(tmp_dir, module_name), target)
+    shutil.rmtree(tmp_dir)
+
+
+def install_new(archive, imp_path, reuse):
+    from patchbox.archive import extract_archive
+    staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=imp_path)
+    extract_archive(archive, staging_dir, reuse_dir=imp_path if reuse else None)
+    target = os.path.join(imp_path, MODULE_NAME)
+    old_path = os.path.join(staging_dir, '.old')
+    if os.path.isdir(target):
+        os.rename(target, old_path)
+    os.rename(os.path.join(staging_dir, MODULE_NAME), target)
+    shutil.rmtree(staging_dir)
+
+
+def measure(name, fn, runs, setup):
+    times = []
+    written = []
+    for _ in range(runs):
+        setup()
+        start_written = get_written_bytes()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+        written.append(get_written_bytes() - start_written)
+    print('{:<8} median {:8.1f} ms  min {:8.1f} ms  {:8.1f} MB written'.format(
+        name, statistics.median(times), min(times), statistics.median(written) / 1024.0 / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=64, help='KiB per file')
+    parser.add_argument('--format', choices=['tar', 'tgz', 'txz', 'zip'], default='tgz')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--dir', help='folder to work in, on the filesystem to measure, a temporary one by default')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+    work_dir = tempfile.mkdtemp(prefix='patchbox-bench-', dir=args.dir)
+    try:
+        archive = create_archive(work_dir, args.files, args.size, args.format)
+        imp_path = os.path.join(work_dir, 'imported')
+        tmp_dir = os.path.join(work_dir, 'tmp')
+
+        def clean():
+            shutil.rmtree(imp_path, ignore_errors=True)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(imp_path)
+
+        def installed():
+            clean()
+            install_new(archive, imp_path, reuse=False)
+
+        print('Bench: {} files of {} KiB, {} archive of {:.1f} MB, {} runs'.format(
+            args.files, args.size, args.format, os.path.getsize(archive) / 1024.0 / 1024.0, args.runs))
+        measure('old', lambda: install_old(archive, tmp_dir, imp_path), args.runs, clean)
+        measure('new', lambda: install_new(archive, imp_path, reuse=False), args.runs, clean)
+        measure('upgrade', lambda: install_new(archive, imp_path, reuse=True), args.runs, installed)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
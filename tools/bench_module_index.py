@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Benchmarks module discovery over a synthetic tree of modules, with and without a valid index
+
+    tools/bench_module_index.py --modules 500 --duplicates 50 --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def create_tree(modules_path, count, duplicates):
+    imported_path = os.path.join(modules_path, 'imported')
+    os.makedirs(imported_path)
+    for i in range(count):
+        roots = [modules_path] + ([imported_path] if i < duplicates else [])
+        for version, root in enumerate(roots):
+            path = os.path.join(root, 'module-{}'.format(i))
+            os.makedirs(path)
+            with open(os.path.join(path, 'patchbox-module.json'), 'w') as f:
+                json.dump({
+                    'name': 'module-{}'.format(i),
+                    'description': 'Synthetic module {}'.format(i),
+                    'version': '1.0.{}'.format(version),
+                    'author': 'bench',
+                    'depends_on': ['jack.service'],
+                    'services': ['module-{}.service'.format(i)],
+                    'launch_mode': 'auto'
+                }, f)
+
+
+def measure(name, fn, runs, setup=None):
+    times = []
+    parsed = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        parsed.append(fn())
+        times.append((time.perf_counter() - start) * 1000.0)
+    print('{:<28} median {:8.1f} ms  min {:8.1f} ms  {:5d} files parsed'.format(
+        name, statistics.median(times), min(times), int(statistics.median(parsed))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', type=int, default=500)
+    parser.add_argument('--duplicates', type=int, default=50, help='modules also present in imported/ with a newer version')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='patchbox-bench-')
+    try:
+        os.environ['PATCHBOX_STATE_DIR'] = os.path.join(work_dir, 'state') + '/'
+        os.makedirs(os.environ['PATCHBOX_STATE_DIR'])
+        modules_path = os.path.join(work_dir, 'modules') + '/'
+        create_tree(modules_path, args.modules, args.duplicates)
+        sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+        from patchbox import settings
+        from patchbox.module import PatchboxModuleManager
+
+        def remove_index():
+            if os.path.exists(settings.PATCHBOX_MODULE_INDEX):
+                os.remove(settings.PATCHBOX_MODULE_INDEX)
+
+        def touch_one():
+            os.utime(os.path.join(modules_path, 'module-0', 'patchbox-module.json'))
+
+        def list_modules():
+            manager = PatchboxModuleManager(path=modules_path, read_only=True)
+            manager.get_all_modules()
+            return manager._index.parsed
+
+        def lookup():
+            manager = PatchboxModuleManager(path=modules_path, read_only=True)
+            manager.get_module_by_name('module-{}'.format(args.modules - 1))
+            return manager._index.parsed
+
+        print('Bench: {} modules, {} duplicated in imported/, {} runs'.format(args.modules, args.duplicates, args.runs))
+        measure('list, no index', list_modules, args.runs, setup=remove_index)
+        measure('list, valid index', list_modules, args.runs)
+        measure('list, one file touched', list_modules, args.runs, setup=touch_one)
+        measure('lookup by name, no index', lookup, args.runs, setup=remove_index)
+        measure('lookup by name, valid index', lookup, args.runs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Benchmarks module activate/deactivate/switch/status against tools/fake_systemd.py
+
+Starts a private dbus-daemon and the fake systemd on it, builds two throwaway
+modules in a temporary folder and times PatchboxModuleManager operations. First
+checks that cached unit properties follow changes made by another client:
+
+    tools/bench_service.py --services 5 --latency 2 --job-time 50 --runs 10
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def start_bus():
+    bus = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address=1'],
+                           stdout=subprocess.PIPE, universal_newlines=True)
+    return bus, bus.stdout.readline().strip()
+
+
+def start_fake_systemd(address, units, args):
+    fake = subprocess.Popen([sys.executable, os.path.join(TOOLS_DIR, 'fake_systemd.py'),
+                             '--address', address,
+                             '--units', ','.join(units),
+                             '--latency', str(args.latency),
+                             '--job-time', str(args.job_time)],
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    # The first line is printed once the bus name is owned.
+    if not fake.stdout.readline():
+        raise RuntimeError('fake_systemd.py failed to start')
+    return fake
+
+
+def create_module(modules_path, name, services, system_services):
+    path = os.path.join(modules_path, name)
+    os.makedirs(path)
+    with open(os.path.join(path, 'patchbox-module.json'), 'w') as f:
+        json.dump({
+            'name': name,
+            'description': 'Benchmark module',
+            'version': '1.0.0',
+            'author': 'bench',
+            'depends_on': system_services,
+            'services': services
+        }, f)
+    return path
+
+
+def measure(name, fn, manager, runs, setup=None):
+    service_manager = manager._service_manager
+    times = []
+    round_trips = []
+    for _ in range(runs):
+        with redirect_stdout(io.StringIO()):
+            if setup:
+                setup()
+            start_round_trips = service_manager.round_trips
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000.0)
+            round_trips.append(service_manager.round_trips - start_round_trips)
+    print('{:<12} median {:8.1f} ms  min {:8.1f} ms  max {:8.1f} ms  {:4d} round trips'.format(
+        name, statistics.median(times), min(times), max(times), int(statistics.median(round_trips))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', type=int, default=5, help='services per module')
+    parser.add_argument('--system-services', type=int, default=1, help='depends_on services per module')
+    parser.add_argument('--latency', type=float, default=1.0, help='milliseconds added to every fake systemd call')
+    parser.add_argument('--job-time', type=float, default=20.0, help='milliseconds each fake systemd job takes')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='patchbox-bench-')
+    modules_path = os.path.join(work_dir, 'modules') + '/'
+    system_services = ['bench-system-{}.service'.format(i) for i in range(args.system_services)]
+    services_a = ['bench-a-{}.service'.format(i) for i in range(args.services)]
+    services_b = ['bench-b-{}.service'.format(i) for i in range(args.services)]
+
+    bus, address = start_bus()
+    fake = start_fake_systemd(address, system_services + services_a + services_b + ['bench-cache.service'], args)
+    try:
+        # settings are read on import, so point everything at the sandbox first.
+        os.environ['PATCHBOX_DBUS_ADDRESS'] = address
+        os.environ['PATCHBOX_STATE_DIR'] = os.path.join(work_dir, 'state') + '/'
+        os.environ['PATCHBOX_ENVIRONMENT_FILE'] = os.path.join(work_dir, 'environment')
+        os.makedirs(os.environ['PATCHBOX_STATE_DIR'])
+        sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+        from patchbox.module import PatchboxModuleManager
+        from check_service_cache import check_property_cache
+
+        module_a_path = create_module(modules_path, 'bench-a', services_a, system_services)
+        module_b_path = create_module(modules_path, 'bench-b', services_b, system_services)
+        manager = PatchboxModuleManager(path=modules_path)
+        module_a = manager.get_module_by_path(module_a_path)
+        module_b = manager.get_module_by_path(module_b_path)
+
+        def activate_a():
+            manager.activate(module_a, autolaunch=False, autoinstall=True)
+
+        def activate_b():
+            manager.activate(module_b, autolaunch=False, autoinstall=True)
+
+        print('Bench: {} services + {} system services per module, {} ms latency, {} ms jobs, {} runs'.format(
+            args.services, args.system_services, args.latency, args.job_time, args.runs))
+        if not check_property_cache('bench-cache.service', address):
+            sys.exit(1)
+        measure('activate', activate_a, manager, args.runs, setup=manager.deactivate)
+        measure('deactivate', manager.deactivate, manager, args.runs, setup=activate_a)
+        measure('switch', activate_b, manager, args.runs, setup=activate_a)
+        measure('status', manager.status, manager, args.runs, setup=activate_a)
+    finally:
+        fake.terminate()
+        bus.terminate()
+        fake.wait()
+        bus.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Runs parallel writers and readers of state.json against a temp state dir, checking for lost updates and reader stalls
+
+Each writer stands in for a module command: a series of transactions, one of
+which stays open for --hold seconds like an install script or a systemd job
+wait would keep a manager operation open.
+
+    tools/bench_state.py --writers 16 --writes 20 --readers 4 --hold 1.0
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def writer(index, writes, hold):
+    from patchbox.state import PatchboxModuleStateManager
+    module = 'module-{}'.format(index)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        state = PatchboxModuleStateManager()
+        for i in range(writes):
+            with state.transaction():
+                state.set('writes', i + 1, module)
+                state.set('auto_launch', 'patch-{}.pd'.format(i), module)
+                state.set('last_writer', module)
+                if i == writes // 2:
+                    time.sleep(hold)
+
+
+def reader(done, results):
+    from patchbox.state import PatchboxModuleStateManager
+    times = []
+    while not done.is_set():
+        start = time.perf_counter()
+        # What `module active` and `module status` do before anything else.
+        PatchboxModuleStateManager(read_only=True).get('active_module')
+        times.append((time.perf_counter() - start) * 1000.0)
+        time.sleep(0.005)
+    results.put(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=20, help='transactions per writer')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--hold', type=float, default=1.0, help='seconds one transaction of each writer stays open')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='patchbox-bench-')
+    try:
+        os.environ['PATCHBOX_STATE_DIR'] = os.path.join(work_dir, 'state') + '/'
+        sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+        from patchbox.state import PatchboxModuleStateManager
+
+        done = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        readers = [multiprocessing.Process(target=reader, args=(done, results)) for _ in range(args.readers)]
+        writers = [multiprocessing.Process(target=writer, args=(i, args.writes, args.hold)) for i in range(args.writers)]
+        start = time.perf_counter()
+        for process in readers + writers:
+            process.start()
+        for process in writers:
+            process.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        times = []
+        for _ in readers:
+            times += results.get()
+        for process in readers:
+            process.join()
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            state = PatchboxModuleStateManager(read_only=True)
+        lost = sum(1 for i in range(args.writers) if state.get('writes', 'module-{}'.format(i)) != args.writes)
+        failed = sum(1 for process in writers if process.exitcode != 0)
+        print('Bench: {} writers x {} transactions, {} readers, {:.1f} s held open per writer'.format(
+            args.writers, args.writes, args.readers, args.hold))
+        print('writers                 {:8.2f} s total, {} failed, {} with lost updates'.format(elapsed, failed, lost))
+        if times:
+            print('reads                   {:8d} done, median {:6.2f} ms, max {:8.2f} ms'.format(
+                len(times), statistics.median(times), max(times)))
+        if failed or lost:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Checks `module watch` on a module whose launch fell back to a plain process
+
+Points the service layer at a bus nobody listens on, so launching through a
+transient unit fails and the module is started with Popen, then checks that
+the watcher follows the launched processes rather than the unit that wasn't
+created, restarts the module once they are gone and is happy again after:
+
+    tools/check_health.py
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def create_module(modules_path, name):
+    path = os.path.join(modules_path, name)
+    os.makedirs(path)
+    with open(os.path.join(path, 'patchbox-module.json'), 'w') as f:
+        json.dump({
+            'name': name,
+            'description': 'Health check module',
+            'version': '1.0.0',
+            'author': 'check',
+            'launch_mode': 'auto',
+            'scripts': {'launch': 'launch.sh'},
+            'health': {'process': True, 'interval': 0.1, 'grace': 0, 'failures': 1}
+        }, f)
+    # Leaves a child behind and exits, like most launch scripts.
+    with open(os.path.join(path, 'launch.sh'), 'w') as f:
+        f.write('sleep 60 &\n')
+    return path + '/'
+
+
+def kill_session(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='patchbox-check-')
+    failures = []
+    pids = []
+    try:
+        # settings are read on import, so point everything at the sandbox first.
+        os.environ['PATCHBOX_DBUS_ADDRESS'] = 'unix:path=' + os.path.join(work_dir, 'no-bus')
+        os.environ['PATCHBOX_STATE_DIR'] = os.path.join(work_dir, 'state') + '/'
+        os.environ['PATCHBOX_ENVIRONMENT_FILE'] = os.path.join(work_dir, 'environment')
+        os.makedirs(os.environ['PATCHBOX_STATE_DIR'])
+        sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+        from patchbox.module import PatchboxModuleManager
+        from patchbox.health import PatchboxModuleWatcher
+
+        modules_path = os.path.join(work_dir, 'modules') + '/'
+        module_path = create_module(modules_path, 'check-health')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            manager = PatchboxModuleManager(path=modules_path)
+            module = manager.get_module_by_path(module_path)
+            manager.activate(module, autolaunch=True, autoinstall=True)
+        state = manager.state
+        pid = state.get('launch_pid', module_path)
+        pids.append(pid)
+        if state.get('launch_unit', module_path) or not pid:
+            failures.append('launch did not fall back to a plain process: unit {}, pid {}'.format(
+                state.get('launch_unit', module_path), pid))
+
+        watcher = PatchboxModuleWatcher(manager)
+
+        def tick():
+            with contextlib.redirect_stdout(output):
+                watcher.tick()
+            return state.get('health', module_path)
+
+        # The launch script has exited by now, its child is what's left running.
+        time.sleep(0.2)
+        health = tick()
+        print('launched     pid {}, health {}'.format(pid, health))
+        if health != 'ok':
+            failures.append('health after the launch is {}, expected ok'.format(health))
+
+        kill_session(pid)
+        time.sleep(0.1)
+        health = tick()
+        relaunched = state.get('launch_pid', module_path)
+        pids.append(relaunched)
+        print('killed       health {}, crashes {}, relaunched as pid {}'.format(
+            health, state.get('crash_count', module_path), relaunched))
+        if state.get('crash_count', module_path) != 1 or relaunched == pid:
+            failures.append('the module was not restarted once after its processes were killed')
+
+        time.sleep(0.2)
+        health = tick()
+        print('restarted    health {}'.format(health))
+        if health != 'ok':
+            failures.append('health after the restart is {}, expected ok'.format(health))
+    finally:
+        for pid in pids:
+            if pid:
+                kill_session(pid)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    if failures:
+        sys.exit(1)
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Checks that cached unit properties follow changes made by another D-Bus client
+
+Starts a private dbus-daemon and tools/fake_systemd.py on it, reads a unit's
+state through a service manager which caches properties, then starts, stops and
+enables the unit with dbus-send, a client patchbox knows nothing about. Every
+read after a change must return the new value:
+
+    tools/check_service_cache.py
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+UNIT = 'check-cache.service'
+
+
+def send(address, method, *args):
+    subprocess.check_call(['dbus-send', '--bus=' + address, '--print-reply', '--dest=org.freedesktop.systemd1',
+                           '/org/freedesktop/systemd1', 'org.freedesktop.systemd1.Manager.' + method] + list(args),
+                          stdout=subprocess.DEVNULL)
+
+
+def wait_for(read, expected, timeout):
+    # The change is announced by signals, give them the time to arrive.
+    deadline = time.monotonic() + timeout
+    value = read()
+    while value != expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+        value = read()
+    return value
+
+
+def check_property_cache(unit, address, timeout=5.0):
+    """Runs the checks on unit, which must be inactive and disabled, returns whether they all passed"""
+    from patchbox.service import PatchboxService, PatchboxServiceManager
+    service = PatchboxService(unit)
+    cached = PatchboxServiceManager(cache_properties=True)
+    ok = True
+
+    def check(name, read, change, expected):
+        nonlocal ok
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = read()
+            round_trips = cached.round_trips
+            change()
+            after = wait_for(read, expected, timeout)
+        passed = after == expected
+        ok = ok and passed
+        print('{:<12} {} -> {}, {} round trips: {}'.format(
+            name, before, after, cached.round_trips - round_trips, 'ok' if passed else 'FAILED'))
+
+    # Cached for longer than the operation once PropertiesChanged is listened to.
+    with contextlib.redirect_stdout(io.StringIO()):
+        with cached.operation('check'):
+            cached.is_active(service)
+            cached.get_enabled(service)
+    check('start', lambda: cached.is_active(service), lambda: send(address, 'StartUnit', 'string:' + unit, 'string:replace'), True)
+    check('stop', lambda: cached.is_active(service), lambda: send(address, 'StopUnit', 'string:' + unit, 'string:replace'), False)
+    check('enable', lambda: cached.get_enabled(service),
+          lambda: send(address, 'EnableUnitFiles', 'array:string:' + unit, 'boolean:false', 'boolean:true'), 'enabled')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--job-time', type=float, default=20.0, help='milliseconds each fake systemd job takes')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for a change to show')
+    args = parser.parse_args()
+
+    sys.path.insert(0, TOOLS_DIR)
+    from bench_service import start_bus, start_fake_systemd
+
+    work_dir = tempfile.mkdtemp(prefix='patchbox-check-')
+    bus, address = start_bus()
+    fake = start_fake_systemd(address, [UNIT], argparse.Namespace(latency=0.0, job_time=args.job_time))
+    try:
+        # settings are read on import, so point everything at the sandbox first.
+        os.environ['PATCHBOX_DBUS_ADDRESS'] = address
+        os.environ['PATCHBOX_STATE_DIR'] = os.path.join(work_dir, 'state') + '/'
+        os.environ['PATCHBOX_ENVIRONMENT_FILE'] = os.path.join(work_dir, 'environment')
+        os.makedirs(os.environ['PATCHBOX_STATE_DIR'])
+        sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+        ok = check_property_cache(UNIT, address, args.timeout)
+    finally:
+        fake.terminate()
+        bus.terminate()
+        fake.wait()
+        bus.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not ok:
+        sys.exit(1)
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Stand-in for the part of systemd's D-Bus API used by patchbox.service
+
+Serves org.freedesktop.systemd1 on a private bus, so the service layer can be
+exercised and benchmarked without touching the real systemd:
+
+    dbus-run-session -- sh -c 'tools/fake_systemd.py --units a.service,b.service & \\
+        sleep 1; PATCHBOX_DBUS_ADDRESS=$DBUS_SESSION_BUS_ADDRESS patchbox module status'
+"""
+import argparse
+import os
+import sys
+import time
+import dbus
+import dbus.bus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+BUS_NAME = 'org.freedesktop.systemd1'
+OBJECT_PATH = '/org/freedesktop/systemd1'
+MANAGER_INTERFACE = 'org.freedesktop.systemd1.Manager'
+UNIT_INTERFACE = 'org.freedesktop.systemd1.Unit'
+SERVICE_INTERFACE = 'org.freedesktop.systemd1.Service'
+
+
+def escape_name(name):
+    # Same escaping systemd uses for unit object paths.
+    escaped = ''
+    for i, c in enumerate(name):
+        if c.isalnum() and c.isascii() and not (i == 0 and c.isdigit()):
+            escaped += c
+        else:
+            escaped += '_{:02x}'.format(ord(c))
+    return escaped
+
+
+def monotonic_usec():
+    return dbus.UInt64(int(time.monotonic() * 1000000))
+
+
+class FakeUnit(dbus.service.Object):
+
+    def __init__(self, manager, name, loaded=True):
+        self.manager = manager
+        self.name = name
+        self.path = '{}/unit/{}'.format(OBJECT_PATH, escape_name(name))
+        self.load_state = 'loaded' if loaded else 'not-found'
+        self.active_state = 'inactive'
+        self.sub_state = 'dead'
+        self.unit_file_state = 'disabled' if loaded else None
+        self.active_enter_timestamp = 0
+        self.exec_main_status = 0
+        self.result = 'success'
+        self.job = None
+        # Properties passed to StartTransientUnit, None for units from --units.
+        self.transient_properties = None
+        super().__init__(manager.connection, self.path)
+
+    def get_properties(self, interface):
+        if interface == UNIT_INTERFACE:
+            return {
+                'Id': self.name,
+                'LoadState': self.load_state,
+                'ActiveState': self.active_state,
+                'SubState': self.sub_state,
+                'ActiveEnterTimestampMonotonic': dbus.UInt64(self.active_enter_timestamp)
+            }
+        if interface == SERVICE_INTERFACE:
+            return {
+                'ExecMainStatus': dbus.Int32(self.exec_main_status),
+                'Result': self.result,
+                'ControlGroup': '/system.slice/' + self.name if self.active_state in ('active', 'activating', 'deactivating') else ''
+            }
+        return {}
+
+    @dbus.service.signal(dbus.PROPERTIES_IFACE, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+    def emit_changed(self):
+        for interface in (UNIT_INTERFACE, SERVICE_INTERFACE):
+            self.PropertiesChanged(interface, self.manager.variant_dict(self.get_properties(interface)), dbus.Array([], signature='s'))
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        self.manager.call('GetAll')
+        return self.manager.variant_dict(self.get_properties(interface))
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss', out_signature='v')
+    def Get(self, interface, prop):
+        self.manager.call('Get')
+        properties = self.get_properties(interface)
+        if prop not in properties:
+            raise dbus.exceptions.DBusException('Unknown property', name='org.freedesktop.DBus.Error.UnknownProperty')
+        return properties[prop]
+
+
+class FakeSystemd(dbus.service.Object):
+
+    def __init__(self, connection, units, latency=0.0, job_time=0.0, failing=None):
+        super().__init__(connection, OBJECT_PATH)
+        self.connection = connection
+        self.latency = latency
+        self.job_time = job_time
+        self.failing = set(failing or [])
+        self.units = {}
+        self.calls = {}
+        self.next_job_id = 1
+        for name in units:
+            self.units[name] = FakeUnit(self, name)
+
+    def call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            # systemd handles one request at a time, so blocking the loop is faithful.
+            time.sleep(self.latency)
+
+    @staticmethod
+    def variant_dict(properties):
+        return dbus.Dictionary(properties, signature='sv')
+
+    def get_unit(self, name):
+        if name not in self.units:
+            self.units[name] = FakeUnit(self, name, loaded=False)
+        return self.units[name]
+
+    def get_unit_file_state(self, name):
+        unit = self.get_unit(name)
+        if unit.unit_file_state is None:
+            raise dbus.exceptions.DBusException('No such file or directory', name='org.freedesktop.DBus.Error.FileNotFound')
+        return unit.unit_file_state
+
+    def set_unit_file_state(self, names, state):
+        changes = []
+        for name in names:
+            unit = self.get_unit(name)
+            if unit.unit_file_state not in (None, 'static', 'masked') and unit.unit_file_state != state:
+                unit.unit_file_state = state
+                changes.append(('symlink' if state == 'enabled' else 'unlink', '/etc/systemd/system/multi-user.target.wants/' + name, '/lib/systemd/system/' + name))
+        if changes:
+            self.UnitFilesChanged()
+        return dbus.Array(changes, signature='(sss)')
+
+    def queue_job(self, name, job_type):
+        unit = self.get_unit(name)
+        if unit.load_state != 'loaded':
+            raise dbus.exceptions.DBusException('Unit {} not found.'.format(name), name='org.freedesktop.systemd1.NoSuchUnit')
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        job_path = dbus.ObjectPath('{}/job/{}'.format(OBJECT_PATH, job_id))
+        unit.job = (job_id, job_type, job_path)
+        if job_type == 'stop':
+            unit.active_state, unit.sub_state = 'deactivating', 'stop'
+        else:
+            unit.active_state, unit.sub_state = 'activating', 'start'
+        unit.emit_changed()
+        GLib.timeout_add(int(self.job_time * 1000), self.finish_job, unit, job_id)
+        return job_path
+
+    def finish_job(self, unit, job_id):
+        if unit.job is None or unit.job[0] != job_id:
+            return False
+        job_id, job_type, job_path = unit.job
+        unit.job = None
+        if job_type == 'stop':
+            unit.active_state, unit.sub_state = 'inactive', 'dead'
+            result = 'done'
+        elif unit.name in self.failing:
+            unit.active_state, unit.sub_state = 'failed', 'failed'
+            unit.exec_main_status, unit.result = 1, 'exit-code'
+            result = 'failed'
+        elif unit.transient_properties is not None and unit.transient_properties.get('RemainAfterExit'):
+            # The launch script is not run, it's taken to have exited right away.
+            unit.active_state, unit.sub_state = 'active', 'exited'
+            unit.active_enter_timestamp = monotonic_usec()
+            unit.exec_main_status, unit.result = 0, 'success'
+            result = 'done'
+        else:
+            unit.active_state, unit.sub_state = 'active', 'running'
+            unit.active_enter_timestamp = monotonic_usec()
+            unit.exec_main_status, unit.result = 0, 'success'
+            result = 'done'
+        # Like systemd, the new state is announced before the job is reported done.
+        unit.emit_changed()
+        self.JobRemoved(dbus.UInt32(job_id), job_path, unit.name, result)
+        if unit.transient_properties is not None and unit.active_state in ('inactive', 'failed') and \
+                unit.transient_properties.get('CollectMode') == 'inactive-or-failed':
+            # Garbage collected, the name can be used for a new transient unit.
+            del self.units[unit.name]
+            unit.remove_from_connection()
+        return False
+
+    @dbus.service.signal(MANAGER_INTERFACE, signature='uoss')
+    def JobRemoved(self, job_id, job, unit, result):
+        pass
+
+    @dbus.service.signal(MANAGER_INTERFACE, signature='')
+    def UnitFilesChanged(self):
+        pass
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='', out_signature='')
+    def Subscribe(self):
+        self.call('Subscribe')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='', out_signature='')
+    def Unsubscribe(self):
+        self.call('Unsubscribe')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='', out_signature='')
+    def Reload(self):
+        self.call('Reload')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='s', out_signature='o')
+    def LoadUnit(self, name):
+        self.call('LoadUnit')
+        return dbus.ObjectPath(self.get_unit(str(name)).path)
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='s', out_signature='s')
+    def GetUnitFileState(self, name):
+        self.call('GetUnitFileState')
+        return self.get_unit_file_state(str(name))
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='as', out_signature='a(ssssssouso)')
+    def ListUnitsByNames(self, names):
+        self.call('ListUnitsByNames')
+        units = []
+        for name in names:
+            unit = self.get_unit(str(name))
+            job_id, job_type, job_path = unit.job or (0, '', '/')
+            units.append((unit.name, unit.name, unit.load_state, unit.active_state, unit.sub_state, '',
+                          dbus.ObjectPath(unit.path), dbus.UInt32(job_id), job_type, dbus.ObjectPath(job_path)))
+        return dbus.Array(units, signature='(ssssssouso)')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='asas', out_signature='a(ss)')
+    def ListUnitFilesByPatterns(self, states, patterns):
+        self.call('ListUnitFilesByPatterns')
+        files = []
+        for unit in self.units.values():
+            if unit.unit_file_state is None or (patterns and unit.name not in patterns):
+                continue
+            if states and unit.unit_file_state not in states:
+                continue
+            files.append(('/lib/systemd/system/' + unit.name, unit.unit_file_state))
+        return dbus.Array(files, signature='(ss)')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='asbb', out_signature='ba(sss)')
+    def EnableUnitFiles(self, names, runtime, force):
+        self.call('EnableUnitFiles')
+        return True, self.set_unit_file_state([str(name) for name in names], 'enabled')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='asb', out_signature='a(sss)')
+    def DisableUnitFiles(self, names, runtime):
+        self.call('DisableUnitFiles')
+        return self.set_unit_file_state([str(name) for name in names], 'disabled')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='ss', out_signature='o')
+    def StartUnit(self, name, mode):
+        self.call('StartUnit')
+        return self.queue_job(str(name), 'start')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='ss', out_signature='o')
+    def RestartUnit(self, name, mode):
+        self.call('RestartUnit')
+        return self.queue_job(str(name), 'restart')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='ssa(sv)a(sa(sv))', out_signature='o')
+    def StartTransientUnit(self, name, mode, properties, aux):
+        self.call('StartTransientUnit')
+        name = str(name)
+        if name in self.units and self.units[name].load_state == 'loaded':
+            raise dbus.exceptions.DBusException('Unit {} already exists.'.format(name), name='org.freedesktop.systemd1.UnitExists')
+        if name in self.units:
+            self.units.pop(name).remove_from_connection()
+        unit = self.units[name] = FakeUnit(self, name)
+        unit.unit_file_state = 'transient'
+        unit.transient_properties = dict((str(key), value) for key, value in properties)
+        return self.queue_job(name, 'start')
+
+    @dbus.service.method(MANAGER_INTERFACE, in_signature='ss', out_signature='o')
+    def StopUnit(self, name, mode):
+        self.call('StopUnit')
+        return self.queue_job(str(name), 'stop')
+
+    @dbus.service.method('io.patchbox.FakeSystemd', in_signature='', out_signature='a{su}')
+    def GetCallCounts(self):
+        return dbus.Dictionary(self.calls, signature='su')
+
+    @dbus.service.method('io.patchbox.FakeSystemd', in_signature='', out_signature='')
+    def ResetCallCounts(self):
+        self.calls = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--address', default=os.environ.get('DBUS_SESSION_BUS_ADDRESS'), help='bus to serve on, defaults to the session bus')
+    parser.add_argument('--units', default='', help='comma separated list of known units')
+    parser.add_argument('--failing', default='', help='comma separated list of units whose start jobs fail')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every call')
+    parser.add_argument('--job-time', type=float, default=0.0, help='milliseconds each job takes to finish')
+    args = parser.parse_args()
+
+    if not args.address:
+        print('Error: no bus address, run under dbus-run-session or pass --address', file=sys.stderr)
+        sys.exit(1)
+
+    DBusGMainLoop(set_as_default=True)
+    connection = dbus.bus.BusConnection(args.address)
+    units = [u for u in args.units.split(',') if u]
+    failing = [u for u in args.failing.split(',') if u]
+    fake = FakeSystemd(connection, units, args.latency / 1000.0, args.job_time / 1000.0, failing)
+    name = dbus.service.BusName(BUS_NAME, connection)
+    print('FakeSystemd: serving {} units on {}'.format(len(units), args.address))
+    sys.stdout.flush()
+    try:
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Serves module archives over HTTP with Range support, for trying out `patchbox module install <url>`
+
+Can drop connections part way through to exercise download resuming:
+
+    tools/serve_modules.py ./dist --port 8000 --drop-after 1048576
+    patchbox module install http://localhost:8000/my-module.tar.gz --checksum sha256:...
+"""
+import argparse
+import os
+import re
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+
+    drop_after = None
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return super().send_head()
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+            return None
+
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            if start >= size:
+                f.close()
+                self.send_error(416, 'Requested range not satisfiable')
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        sent = 0
+        while self._remaining > 0:
+            chunk = source.read(min(64 * 1024, self._remaining))
+            if not chunk:
+                break
+            if self.drop_after is not None and sent + len(chunk) > self.drop_after:
+                outputfile.write(chunk[:self.drop_after - sent])
+                # Simulate the connection dropping mid-transfer.
+                self.close_connection = True
+                return
+            outputfile.write(chunk)
+            sent += len(chunk)
+            self._remaining -= len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--drop-after', type=int, help='close every response after this many bytes')
+    args = parser.parse_args()
+
+    RangeRequestHandler.drop_after = args.drop_after
+    server = ThreadingHTTPServer(('', args.port), partial(RangeRequestHandler, directory=args.directory))
+    print('Serving {} on port {}'.format(os.path.abspath(args.directory), args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()